@@ -1,29 +1,370 @@
 from __future__ import annotations
 
 import os
+import stat
 import sys
 
+# avoid importing typing at startup, which costs more than scanning a small PATH
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import Iterable, NoReturn
 
-def get_executables(path: str) -> set[str]:
+
+DEFAULT_ROOT_PATH = "/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin"
+
+
+def realpath_in_root(root: str, path: str) -> str:
+    """Like os.path.realpath, inside a root filesystem such as a container or /proc/PID/root.
+
+    Absolute symlinks are followed relative to root, and .. never escapes it.
+    The result is relative to root, e.g. /usr/bin.
+    """
+    parts = path.split("/")
+    parts.reverse()
+    resolved: list[str] = []
+    links = 0
+    while parts:
+        part = parts.pop()
+        if part in ("", "."):
+            continue
+        if part == "..":
+            if resolved:
+                resolved.pop()
+            continue
+        try:
+            target = os.readlink(os.path.join(root + "/", *resolved, part))
+        except OSError:
+            resolved.append(part)
+            continue
+        links += 1
+        if links > 40:
+            # give up on symlink loops like realpath does
+            resolved.append(part)
+            break
+        if target.startswith("/"):
+            resolved.clear()
+        parts.extend(reversed(target.split("/")))
+    return "/" + "/".join(resolved)
+
+
+def canonicalize(path: str, root: str = "") -> list[str]:
+    """Split a PATH into its unique real directories, in order.
+
+    e.g. on merged-/usr systems /bin and /usr/bin are the same directory.
+    If root is given, the PATH is resolved inside it, see realpath_in_root,
+    and relative directories are dropped.
+    """
+    if root:
+        return list(
+            dict.fromkeys(
+                realpath_in_root(root, directory)
+                for directory in path.split(":")
+                if directory.startswith("/")
+            )
+        )
+    return list(
+        dict.fromkeys(
+            os.path.realpath(directory) for directory in path.split(":") if directory
+        )
+    )
+
+
+def is_executable(entry: os.DirEntry, root: str = "") -> bool:
+    """Like the specification, but a symlink counts only if its target is an executable file.
+
+    If root is given, the entry is under root and its symlinks are resolved inside it.
+    """
+    try:
+        if entry.is_symlink():
+            st = (
+                os.stat(root + realpath_in_root(root, entry.path[len(root) :]))
+                if root
+                else entry.stat()
+            )
+            return stat.S_ISREG(st.st_mode) and bool(st.st_mode & 0o111)
+        return entry.is_file() and bool(
+            entry.stat(follow_symlinks=False).st_mode & 0o111
+        )
+    except OSError:
+        return False
+
+
+def scan_directory(
+    directory: str, *, check_links: bool = False, root: str = ""
+) -> frozenset[str]:
+    """Get the executables in a single directory, empty if it cannot be listed.
+
+    The type and mode of each entry come from its DirEntry, which caches them.
+    If check_links, symlinks are followed to check that their targets exist and are executable,
+    inside root if given, in which case directory must be under root.
+    """
+    try:
+        with os.scandir(directory) as entries:
+            if check_links:
+                return frozenset(
+                    entry.name for entry in entries if is_executable(entry, root)
+                )
+            return frozenset(
+                entry.name
+                for entry in entries
+                if entry.is_symlink()
+                or (
+                    entry.is_file()
+                    and (entry.stat(follow_symlinks=False).st_mode & 0o111)
+                )
+            )
+    except OSError:
+        return frozenset()
+
+
+def get_executables(path: str, *, check_links: bool = False) -> set[str]:
+    return set().union(
+        *(
+            scan_directory(directory, check_links=check_links)
+            for directory in canonicalize(path)
+        )
+    )
+
+
+def get_inventory(
+    paths: list[str],
+    *,
+    roots: list[str] | None = None,
+    check_links: bool = False,
+    jobs: int | None = None,
+) -> dict[str, frozenset[str]]:
+    """Scan each unique real directory of all PATHs once, concurrently.
+
+    The inventory is keyed by root followed by the directories returned by canonicalize.
+    Directories are deduplicated by device and inode, so processes and roots
+    sharing a mount are scanned once. With check_links, symlinks are resolved
+    inside the root of the directory, so directories are only shared within a root.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    directories: dict[str, tuple[int, int, str] | None] = {}
+    for path, root in zip(paths, roots or [""] * len(paths)):
+        for directory in canonicalize(path, root):
+            if (host := root + directory) not in directories:
+                try:
+                    st = os.stat(host)
+                    directories[host] = (
+                        st.st_dev,
+                        st.st_ino,
+                        root if check_links else "",
+                    )
+                except OSError:
+                    directories[host] = None
+    unique = {
+        key: host for host, key in reversed(directories.items()) if key is not None
+    }
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        scanned = dict(
+            zip(
+                unique,
+                executor.map(
+                    lambda key: scan_directory(
+                        unique[key], check_links=check_links, root=key[2]
+                    ),
+                    unique,
+                ),
+            )
+        )
     return {
-        entry.name
-        for directory in path.split(":")
-        if os.path.isdir(directory)
-        for entry in os.scandir(directory)
-        if entry.is_symlink()
-        or (
-            entry.is_file()
-            and (os.stat(entry.path, follow_symlinks=False).st_mode & 0o111)
+        host: frozenset() if key is None else scanned[key]
+        for host, key in directories.items()
+    }
+
+
+def get_index(
+    path: str,
+    inventory: dict[str, frozenset[str]],
+    root: str = "",
+) -> dict[str, list[str]]:
+    """Map each command to the real directories providing it, in PATH order.
+
+    The first directory is the one the command resolves to, the rest are shadowed.
+    Directories are relative to root.
+    """
+    index: dict[str, list[str]] = {}
+    for directory in canonicalize(path, root):
+        for command in inventory[root + directory]:
+            index.setdefault(command, []).append(directory)
+    return index
+
+
+def read_process_path(pid: int) -> str:
+    """Read the PATH of a running process from /proc/PID/environ."""
+    try:
+        with open(f"/proc/{pid}/environ", "rb") as file:
+            environ = file.read()
+    except OSError as e:
+        print(f"Cannot read the environment of process {pid}: {e}", file=sys.stderr)
+        sys.exit(1)
+    for variable in environ.split(b"\0"):
+        if variable.startswith(b"PATH="):
+            return os.fsdecode(variable[5:])
+    return ""
+
+
+SNAPSHOT_VERSION = 1
+
+
+def is_snapshot(path: str) -> bool:
+    """Whether a PATH argument names a snapshot file rather than a PATH of directories."""
+    return os.path.isfile(path)
+
+
+def load_snapshot(file: str) -> dict:
+    """Load a snapshot written by save_snapshot.
+
+    Returns a source, see get_sources, with the targets and hashes if the snapshot has them.
+    """
+    import json
+
+    try:
+        with open(file, encoding="utf-8") as f:
+            data = json.load(f)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        # any other file given instead of a PATH, e.g. a binary
+        data = None
+    if not isinstance(data, dict) or data.get("version") != SNAPSHOT_VERSION:
+        print(
+            f"{file}: not a diffpath snapshot of version {SNAPSHOT_VERSION}",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+    directories = data["directories"]
+    return {
+        "index": {
+            command: [directories[i] for i in positions]
+            for command, positions in data["commands"].items()
+        },
+        "targets": data.get("targets"),
+        "hashes": data.get("hashes"),
+    }
+
+
+def get_sources(
+    paths: list[str],
+    *,
+    roots: list[str] | None = None,
+    check_links: bool = False,
+    jobs: int | None = None,
+) -> list[dict]:
+    """Get the index of each PATH or snapshot file.
+
+    Each source is a dict with the index, see get_index, under "index",
+    and for snapshots taken with hashes, the resolved "targets" and their "hashes".
+    Each PATH is resolved inside the root at the same position in roots, if not empty.
+    The directories of all live PATHs are scanned once, see get_inventory.
+    """
+    roots = roots or [""] * len(paths)
+    snapshots = [not root and is_snapshot(path) for path, root in zip(paths, roots)]
+    live = [
+        (path, root)
+        for path, root, snapshot in zip(paths, roots, snapshots)
+        if not snapshot
+    ]
+    inventory = (
+        get_inventory(
+            [path for path, _ in live],
+            roots=[root for _, root in live],
+            check_links=check_links,
+            jobs=jobs,
+        )
+        if live
+        else {}
+    )
+    return [
+        (
+            load_snapshot(path)
+            if snapshot
+            else {"index": get_index(path, inventory, root), "root": root}
         )
+        for path, root, snapshot in zip(paths, roots, snapshots)
+    ]
+
+
+def resolve_targets(
+    index: dict[str, list[str]],
+    commands: Iterable[str],
+    root: str = "",
+) -> dict[str, str]:
+    """Resolve commands to the real files they run, including root if given."""
+    if root:
+        return {
+            command: root
+            + realpath_in_root(root, os.path.join(index[command][0], command))
+            for command in commands
+        }
+    return {
+        command: os.path.realpath(os.path.join(index[command][0], command))
+        for command in commands
     }
 
 
+def save_snapshot(
+    file: str,
+    path: str,
+    *,
+    root: str = "",
+    content: bool = False,
+    check_links: bool = False,
+    jobs: int | None = None,
+) -> None:
+    """Save the inventory of a PATH, comparable later in place of the PATH.
+
+    The snapshot records the real directories of the PATH and, for each command,
+    the directories providing it in PATH order.
+    If content, it also records the resolved target and the hash of each command.
+    """
+    import json
+
+    directories = canonicalize(path, root)
+    index = get_index(
+        path,
+        get_inventory([path], roots=[root], check_links=check_links, jobs=jobs),
+        root,
+    )
+    position = {directory: i for i, directory in enumerate(directories)}
+    data: dict = {
+        "version": SNAPSHOT_VERSION,
+        "path": path,
+        "directories": directories,
+        "commands": {
+            command: [position[directory] for directory in index[command]]
+            for command in sorted(index)
+        },
+    }
+    if content:
+        targets = resolve_targets(index, sorted(index), root)
+        digests = hash_targets(targets.values(), jobs=jobs)
+        data["targets"] = targets
+        data["hashes"] = {
+            command: digests[target] for command, target in targets.items()
+        }
+    with open(file, "w", encoding="utf-8") as f:
+        json.dump(data, f, separators=(",", ":"))
+
+
 def diffpath(
     path1: str,
     path2: str,
+    *,
+    roots: list[str] | None = None,
+    check_links: bool = False,
 ) -> None:
-    executables1 = get_executables(path1)
-    executables2 = get_executables(path2)
+    if any(roots or ()) or is_snapshot(path1) or is_snapshot(path2):
+        executables1, executables2 = (
+            set(source["index"])
+            for source in get_sources(
+                [path1, path2], roots=roots, check_links=check_links
+            )
+        )
+    else:
+        executables1 = get_executables(path1, check_links=check_links)
+        executables2 = get_executables(path2, check_links=check_links)
     for command in sorted(executables1 ^ executables2):
         if command in executables1:
             print(command)
@@ -31,11 +372,301 @@ def diffpath(
             print(f"\t{command}")
 
 
+def diffpath_matrix(
+    paths: list[str],
+    *,
+    format: str = "text",
+    roots: list[str] | None = None,
+    check_links: bool = False,
+    jobs: int | None = None,
+) -> None:
+    """Print which commands each PATH provides, for commands not in all of them.
+
+    format is one of text, tsv, or json.
+    """
+    roots = roots or [""] * len(paths)
+    executables = [
+        frozenset(source["index"])
+        for source in get_sources(
+            paths, roots=roots, check_links=check_links, jobs=jobs
+        )
+    ]
+    commands = sorted(
+        frozenset().union(*executables) - frozenset.intersection(*executables)
+    )
+    if format == "json":
+        import json
+
+        json.dump(
+            {
+                "paths": paths,
+                "roots": roots,
+                "commands": {
+                    command: [command in e for e in executables] for command in commands
+                },
+            },
+            sys.stdout,
+            indent=2,
+        )
+        print()
+    elif format == "tsv":
+        print("\t".join(["command", *(f"PATH{i}" for i in range(1, len(paths) + 1))]))
+        for command in commands:
+            print(
+                "\t".join(
+                    [command, *("1" if command in e else "0" for e in executables)]
+                )
+            )
+    else:
+        for i, (path, root) in enumerate(zip(paths, roots), 1):
+            print(f"# {i}: {path}" + (f" in {root}" if root else ""))
+        width = max(map(len, commands), default=0)
+        columns = [str(i) for i in range(1, len(paths) + 1)]
+        print(" " * width, *columns)
+        for command in commands:
+            print(
+                command.ljust(width),
+                *(
+                    ("X" if command in e else ".").rjust(len(column))
+                    for e, column in zip(executables, columns)
+                ),
+            )
+
+
+def diffpath_resolve(
+    paths: list[str],
+    *,
+    shadowed: bool = False,
+    roots: list[str] | None = None,
+    check_links: bool = False,
+    jobs: int | None = None,
+) -> None:
+    """Print where commands resolve to when that differs between PATHs.
+
+    Each line is the command followed by the resolving directory in each PATH,
+    or - if the PATH does not provide it.
+    If shadowed, instead print each command provided by more than one directory
+    of a PATH, as the PATH number, the command, and the directories in PATH order.
+    """
+    indices = [
+        source["index"]
+        for source in get_sources(
+            paths, roots=roots, check_links=check_links, jobs=jobs
+        )
+    ]
+    if shadowed:
+        for i, index in enumerate(indices, 1):
+            for command in sorted(index):
+                if len(directories := index[command]) > 1:
+                    print(i, command, *directories, sep="\t")
+        return
+    for command in sorted(frozenset().union(*indices)):
+        resolved = [index[command][0] if command in index else "-" for index in indices]
+        if len(set(resolved)) > 1:
+            print(command, *resolved, sep="\t")
+
+
+def default_hash_cache_path() -> str:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache_home, "diffpath", "hashes.json")
+
+
+def load_hash_cache(path: str) -> dict[str, str]:
+    import json
+
+    try:
+        with open(path, encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_hash_cache(path: str, cache: dict[str, str]) -> None:
+    import json
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as file:
+            json.dump(cache, file, separators=(",", ":"))
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"Cannot write hash cache {path}: {e}", file=sys.stderr)
+
+
+def hash_file(path: str) -> str | None:
+    import hashlib
+
+    try:
+        with open(path, "rb") as file:
+            # TODO: py311+: hashlib.file_digest(file, "sha256")
+            digest = hashlib.sha256()
+            while chunk := file.read(1 << 20):
+                digest.update(chunk)
+            return digest.hexdigest()
+    except OSError:
+        return None
+
+
+def hash_files(
+    paths: Iterable[str],
+    cache: dict[str, str],
+    *,
+    jobs: int | None = None,
+) -> dict[str, str | None]:
+    """Hash the contents of files, None if unreadable.
+
+    The cache maps (device, inode, size, mtime) to digests and is updated in place,
+    so only new or modified files are read, each once however many paths lead to it.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    keys: dict[str, str | None] = {}
+    for path in dict.fromkeys(paths):
+        try:
+            st = os.stat(path)
+        except OSError:
+            keys[path] = None
+            continue
+        keys[path] = f"{st.st_dev}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}"
+    missing = {key: path for path, key in keys.items() if key and key not in cache}
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for key, digest in zip(missing, executor.map(hash_file, missing.values())):
+            if digest is not None:
+                cache[key] = digest
+    return {path: key and cache.get(key) for path, key in keys.items()}
+
+
+def hash_targets(
+    targets: Iterable[str],
+    *,
+    jobs: int | None = None,
+    cache_path: str | None = None,
+) -> dict[str, str | None]:
+    """Hash files with hash_files, using and updating the persistent cache."""
+    cache_path = cache_path or default_hash_cache_path()
+    cache = load_hash_cache(cache_path)
+    size = len(cache)
+    digests = hash_files(targets, cache, jobs=jobs)
+    if len(cache) != size:
+        save_hash_cache(cache_path, cache)
+    return digests
+
+
+def diffpath_content(
+    paths: list[str],
+    *,
+    roots: list[str] | None = None,
+    check_links: bool = False,
+    jobs: int | None = None,
+    cache_path: str | None = None,
+) -> None:
+    """Print commands provided by all PATHs that resolve to different contents.
+
+    Each line is the command followed by the resolved target in each PATH.
+    Snapshots must have been taken with hashes.
+    """
+    sources = get_sources(paths, roots=roots, check_links=check_links, jobs=jobs)
+    commands = sorted(frozenset.intersection(*(frozenset(s["index"]) for s in sources)))
+    for path, source in zip(paths, sources):
+        if "targets" not in source:
+            source["targets"] = resolve_targets(
+                source["index"], commands, source["root"]
+            )
+        elif source["hashes"] is None:
+            print(f"{path}: snapshot taken without --content", file=sys.stderr)
+            sys.exit(1)
+    digests = hash_targets(
+        (
+            source["targets"][command]
+            for source in sources
+            if source.get("hashes") is None
+            for command in commands
+        ),
+        jobs=jobs,
+        cache_path=cache_path,
+    )
+    for command in commands:
+        hashes = {
+            (
+                digests[source["targets"][command]]
+                if source.get("hashes") is None
+                else source["hashes"].get(command)
+            )
+            for source in sources
+        }
+        if len(hashes) > 1:
+            print(
+                command, *(source["targets"][command] for source in sources), sep="\t"
+            )
+
+
+def usage() -> NoReturn:
+    print(f"Usage: {sys.argv[0]} PATH1 PATH2", file=sys.stderr)
+    sys.exit(1)
+
+
 def main() -> None:
-    if len(sys.argv) != 3:
-        print(f"Usage: {sys.argv[0]} PATH1 PATH2", file=sys.stderr)
-        sys.exit(1)
-    diffpath(sys.argv[1], sys.argv[2])
+    argv = sys.argv[1:]
+    # the specification: exactly two PATHs and no option
+    if len(argv) == 2 and not any(arg.startswith("-") for arg in argv):
+        diffpath(argv[0], argv[1])
+        return
+
+    import argparse
+
+    class ArgumentParser(argparse.ArgumentParser):
+        def error(self, message: str) -> NoReturn:
+            usage()
+
+    parser = ArgumentParser(add_help=False)
+    parser.add_argument("paths", nargs="*")
+    parser.add_argument("--pid", type=int, action="append", default=[])
+    parser.add_argument("--root", action="append", default=[])
+    parser.add_argument("--root-path", default=DEFAULT_ROOT_PATH)
+    parser.add_argument("--format", choices=["text", "tsv", "json"])
+    parser.add_argument("-j", "--jobs", type=int)
+    parser.add_argument("--resolve", action="store_true")
+    parser.add_argument("--shadowed", action="store_true")
+    parser.add_argument("--content", action="store_true")
+    parser.add_argument("--check-links", action="store_true")
+    parser.add_argument("--save")
+    args = parser.parse_args(argv)
+    # sources in order: PATHs, then processes, then root filesystems
+    paths = [
+        *args.paths,
+        *map(read_process_path, args.pid),
+        *(args.root_path for _ in args.root),
+    ]
+    roots = [
+        *("" for _ in args.paths),
+        *(f"/proc/{pid}/root" for pid in args.pid),
+        *(root.rstrip("/") for root in args.root),
+    ]
+    kwargs = {"roots": roots, "check_links": args.check_links, "jobs": args.jobs}
+    if args.save is not None:
+        if len(paths) != 1:
+            usage()
+        save_snapshot(
+            args.save,
+            paths[0],
+            root=roots[0],
+            content=args.content,
+            check_links=args.check_links,
+            jobs=args.jobs,
+        )
+    elif args.shadowed and paths:
+        diffpath_resolve(paths, shadowed=True, **kwargs)
+    elif len(paths) < 2:
+        usage()
+    elif args.content:
+        diffpath_content(paths, **kwargs)
+    elif args.resolve:
+        diffpath_resolve(paths, **kwargs)
+    elif len(paths) == 2 and args.format is None:
+        diffpath(*paths, roots=roots, check_links=args.check_links)
+    else:
+        diffpath_matrix(paths, format=args.format or "text", **kwargs)
 
 
 if __name__ == "__main__":
@@ -9,16 +9,30 @@ git repositories and subdirectories of git repositories.
 from __future__ import annotations
 
 import argparse
+import json
 import logging
+import mmap
 import os
+import queue
+import re
+import shutil
+import stat
+import struct
 import subprocess
 import sys
+import tempfile
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+from functools import lru_cache
 from itertools import chain
 from pathlib import Path
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, NamedTuple
 
 if TYPE_CHECKING:
-    from typing import Iterable, Literal
+    from typing import IO, Any, Iterable, Iterator, Literal, Sequence
 
 try:
     from coloredlogs import ColoredFormatter as Formatter
@@ -34,11 +48,64 @@ logger.setLevel(logging.DEBUG)
 logger.propagate = False
 
 
+def _git_records(
+    directory: Path, command: list[str], *, stream: bool = False
+) -> Iterable[str]:
+    """
+    Run a git command and split its output into NUL-delimited records.
+
+    Args:
+        directory (Path): The directory to run the command in.
+        command (list[str]): The command to run.
+        stream (bool): Read the output in chunks while git runs, so that memory does not
+            grow with the output. Otherwise, read it all once git exits.
+
+    Returns:
+        Iterable[str]: The records, possibly including empty ones. On failure, git's stderr
+            is logged and no more records are returned.
+    """
+    logger.debug("Running command: %s", subprocess.list2cmdline(command))
+    if not stream:
+        try:
+            result = subprocess.run(
+                command,
+                cwd=directory,
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+        except subprocess.CalledProcessError as e:
+            logger.info("%s: %s", directory, e.stderr)
+            return []
+        return result.stdout.split("\0")
+    return _stream_git_records(directory, command)
+
+
+def _stream_git_records(directory: Path, command: list[str]) -> Iterator[str]:
+    """Run a git command and yield its NUL-delimited records as they are read."""
+    with tempfile.TemporaryFile() as stderr, subprocess.Popen(
+        command,
+        cwd=directory,
+        stdout=subprocess.PIPE,
+        stderr=stderr,
+        text=True,
+    ) as process:
+        assert process.stdout is not None
+        yield from _read_records(process.stdout, nul=True)
+        if process.wait() != 0:
+            stderr.seek(0)
+            logger.info(
+                "%s: %s", directory, stderr.read().decode(errors="backslashreplace")
+            )
+
+
 def git_status_ignored(
     directory: Path,
     *,
     version: Literal[1, 2] = 1,
     expand_directory: bool = False,
+    config: Sequence[str] = (),
+    stream: bool = False,
 ) -> Iterable[str]:
     """
     Get all git-ignored files under the given directory.
@@ -47,6 +114,8 @@ def git_status_ignored(
         directory (Path): The directory to search for git-ignored files. This must be the root of a git repository.
         version (Literal[1, 2]): The version of git status porcelain format to use (1 or 2).
         expand_directory (bool): Whether to list files in git-ignored directories.
+        config (Sequence[str]): Options passed to git before the subcommand, such as ``-c`` overrides.
+        stream (bool): Read the output of git as it runs instead of all at once, see `_git_records`.
 
     Returns:
         Iterable[str]: A generator of relative paths to git-ignored files.
@@ -56,6 +125,7 @@ def git_status_ignored(
 
     command = [
         "git",
+        *config,
         "status",
         ".",
         "--ignored",
@@ -66,40 +136,459 @@ def git_status_ignored(
     ]
     if expand_directory:
         command.append("--untracked-files=all")
+    records = _git_records(directory, command, stream=stream)
+    return (line[n:] for line in records if line.startswith(ignored_prefix))
+
+
+def git_ls_files_ignored(
+    directory: Path,
+    *,
+    expand_directory: bool = False,
+    config: Sequence[str] = (),
+    stream: bool = False,
+) -> Iterable[str]:
+    """
+    Get all git-ignored files under the given directory using ``git ls-files``.
+
+    Unlike `git_status_ignored`, this does not refresh the index,
+    so tracked files are not stat'ed. The records are the same as
+    ``git status --ignored`` with the default ``traditional`` mode.
+    As ``--directory`` collapses untracked directories without listing the
+    ignored files inside them, those directories are listed again, see `_ignored_in_untracked`.
+
+    Args:
+        directory (Path): The directory to search for git-ignored files. This must be the root of a git repository.
+        expand_directory (bool): Whether to list files in git-ignored directories.
+        config (Sequence[str]): Options passed to git before the subcommand, such as ``-c`` overrides.
+        stream (bool): Read the output of git as it runs instead of all at once, see `_git_records`.
+
+    Returns:
+        Iterable[str]: A generator of paths to git-ignored files, relative to the root of the git repository.
+    """
+    command = [
+        "git",
+        *config,
+        "ls-files",
+        "--others",
+        "--ignored",
+        "--exclude-standard",
+        "--full-name",
+        "-z",
+    ]
+    if expand_directory:
+        command.append(".")
+        return (
+            line for line in _git_records(directory, command, stream=stream) if line
+        )
+    # in a subdirectory, "." does not match the ignored directory that encloses it
+    # and that git status lists, but naming the subdirectory from its parent does
+    pathspec = (
+        "."
+        if (directory / ".git").exists()
+        else ":(literal)../" + directory.resolve().name
+    )
+    command += ["--directory", "--no-empty-directory", pathspec]
+    records = _git_records(directory, command, stream=stream)
+    res = chain(
+        (line for line in records if line),
+        _ignored_in_untracked(directory, pathspec, config=config, stream=stream),
+    )
+    # run the listings of the untracked directories now, unless streaming
+    return res if stream else list(res)
+
+
+def _ignored_in_untracked(
+    directory: Path,
+    pathspec: str = ".",
+    *,
+    config: Sequence[str] = (),
+    stream: bool = False,
+) -> Iterator[str]:
+    """
+    List the ignored entries inside the untracked directories under the given directory.
+
+    ``git status`` descends into an untracked directory and reports the ignored entries in it,
+    collapsing each subdirectory that holds no untracked file. This expands the untracked
+    directories with ``git ls-files`` and collapses the ignored files the same way.
+
+    Args:
+        directory (Path): The directory to run git in.
+        pathspec (str): The pathspec of the directory to search for git-ignored files.
+        config (Sequence[str]): Options passed to git before the subcommand, such as ``-c`` overrides.
+        stream (bool): Read the ignored files as git lists them, see `_git_records`.
+
+    Returns:
+        Iterator[str]: Paths relative to the root of the git repository, directories with a trailing slash.
+    """
+    command = [
+        "git",
+        *config,
+        "ls-files",
+        "--others",
+        "--exclude-standard",
+        "--full-name",
+        "-z",
+    ]
+    untracked_dirs = [
+        line
+        for line in _git_records(
+            directory, [*command, "--directory", "--no-empty-directory", pathspec]
+        )
+        if line.endswith("/")
+    ]
+    if not untracked_dirs:
+        return
+    pathspecs = [f":(top,literal){path}" for path in untracked_dirs]
+    # directories holding an untracked file, which git status does not collapse
+    dirty = set()
+    untracked = _git_records(directory, [*command, "--", *pathspecs])
+    for line in chain(untracked_dirs, untracked):
+        parts = line.split("/")
+        dirty.update("/".join(parts[:i]) + "/" for i in range(1, len(parts)))
+    collapsed = set()
+    ignored = _git_records(
+        directory, [*command, "--ignored", "--", *pathspecs], stream=stream
+    )
+    for line in ignored:
+        if not line:
+            continue
+        parts = line.rstrip("/").split("/")
+        for i in range(1, len(parts)):
+            prefix = "/".join(parts[:i]) + "/"
+            if prefix not in dirty:
+                if prefix not in collapsed:
+                    collapsed.add(prefix)
+                    yield prefix
+                break
+        else:
+            yield line
+
+
+def git_status_matching_ignored(
+    directory: Path,
+    *,
+    config: Sequence[str] = (),
+    stream: bool = False,
+) -> Iterable[str]:
+    """
+    Get the paths matching an ignore pattern under the given directory.
+
+    This uses ``git status --ignored=matching``, which stops at paths that match a pattern:
+    a matched directory is listed without its contents, but a directory that only
+    contains ignored files is listed by its contents rather than by itself.
+    Files in git-ignored directories cannot be expanded in this mode.
+
+    Args:
+        directory (Path): The directory to search for git-ignored files. This must be the root of a git repository.
+        config (Sequence[str]): Options passed to git before the subcommand, such as ``-c`` overrides.
+        stream (bool): Read the output of git as it runs instead of all at once, see `_git_records`.
+
+    Returns:
+        Iterable[str]: A generator of paths to git-ignored files, relative to the root of the git repository.
+    """
+    command = [
+        "git",
+        *config,
+        "status",
+        ".",
+        "--ignored=matching",
+        "--ignore-submodules=all",
+        "--no-renames",
+        "--porcelain=1",
+        "-z",
+    ]
+    records = _git_records(directory, command, stream=stream)
+    return (line[3:] for line in records if line.startswith("!! "))
+
+
+# the auto backend uses ls-files from this many tracked files on,
+# below it the index refresh of git status is cheap
+AUTO_LS_FILES_MIN_ENTRIES = 5000
+_INDEX_HEADER = struct.Struct(">4sII")
+
+
+def _count_index_entries(root: Path) -> int:
+    """
+    Read the number of tracked files from the header of the git index.
+
+    Args:
+        root (Path): The root of a git working tree.
+
+    Returns:
+        int: The number of index entries, 0 if the index cannot be read.
+    """
+    git_dir = _resolve_git_dir(root / ".git")
+    if git_dir is None:
+        return 0
     try:
-        logger.debug("Running command: %s", subprocess.list2cmdline(command))
-        result = subprocess.run(
-            command,
-            cwd=directory,
-            capture_output=True,
-            text=True,
-            check=True,
+        with (git_dir / "index").open("rb") as file:
+            signature, _, entries = _INDEX_HEADER.unpack(file.read(_INDEX_HEADER.size))
+    except (OSError, struct.error):
+        return 0
+    return entries if signature == b"DIRC" else 0
+
+
+def choose_backend(root: Path) -> Literal["status", "ls-files"]:
+    """
+    Choose the listing backend of a git repository by its number of tracked files.
+
+    Args:
+        root (Path): The root of a git working tree.
+
+    Returns:
+        Literal["status", "ls-files"]: ``ls-files`` if the repository tracks
+            at least `AUTO_LS_FILES_MIN_ENTRIES` files, otherwise ``status``.
+    """
+    entries = _count_index_entries(root)
+    backend = "ls-files" if entries >= AUTO_LS_FILES_MIN_ENTRIES else "status"
+    logger.debug("%s: %d tracked files, using %s", root, entries, backend)
+    return backend
+
+
+def _run_git(root: Path, *args: str) -> subprocess.CompletedProcess[str]:
+    command = ["git", *args]
+    logger.debug("Running command: %s", subprocess.list2cmdline(command))
+    return subprocess.run(command, cwd=root, capture_output=True, text=True)
+
+
+@lru_cache(maxsize=None)
+def fsmonitor_daemon_supported() -> bool:
+    """
+    Check whether this git build ships the built-in fsmonitor daemon.
+
+    Returns:
+        bool: True if ``git version --build-options`` lists the feature.
+    """
+    try:
+        result = _run_git(Path("."), "version", "--build-options")
+    except OSError:
+        return False
+    return "feature: fsmonitor--daemon" in result.stdout
+
+
+def default_accelerate_path() -> Path:
+    """
+    Get the default location of the acceleration timings file.
+
+    Returns:
+        Path: ``$XDG_CACHE_HOME/gitignored/accelerate.json``, falling back to ``~/.cache``.
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME")
+    return (
+        (Path(cache_home) if cache_home else Path.home() / ".cache")
+        / "gitignored"
+        / "accelerate.json"
+    )
+
+
+class Accelerator:
+    """
+    Use the fsmonitor daemon so that ``git status`` skips refreshing the index.
+
+    ``git status`` stats every tracked file to refresh the index. With ``core.fsmonitor``,
+    it only stats the files the daemon reports as changed. Only this refresh is accelerated:
+    git bypasses the untracked cache when listing ignored files or given a pathspec,
+    so the directory walk costs the same, and the ``ls-files`` backend never refreshes the index.
+
+    The first scan of each repository runs without the daemon, and its duration is
+    recorded as the baseline that later, accelerated scans are compared with.
+    """
+
+    def __init__(self, path: Path | None = None, *, persist: bool = False) -> None:
+        """
+        Args:
+            path (Path | None): The timings file, see `default_accelerate_path`. None to not record timings.
+            persist (bool): Write ``core.fsmonitor`` to the repository config instead of
+                passing a ``-c`` override to every invocation.
+        """
+        self.path = path
+        self.persist = persist
+        # overrides by repository, None if it cannot be accelerated
+        self._config: dict[Path, list[str] | None] = {}
+        # repositories whose current scan is a baseline
+        self._baseline: set[Path] = set()
+        self.timings: dict[str, dict[str, Any]] = {}
+        if not fsmonitor_daemon_supported():
+            logger.info("This git has no fsmonitor daemon, scans are not accelerated")
+        if path is None:
+            return
+        try:
+            with path.open("r", encoding="utf-8") as file:
+                self.timings = json.load(file)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.info("Ignoring unreadable timings file %s: %s", path, e)
+
+    def _start_daemon(self, root: Path) -> bool:
+        if not fsmonitor_daemon_supported():
+            return False
+        if _run_git(root, "fsmonitor--daemon", "status").returncode == 0:
+            return True
+        result = _run_git(root, "fsmonitor--daemon", "start")
+        if result.returncode != 0:
+            logger.info("%s: cannot start fsmonitor daemon: %s", root, result.stderr)
+            return False
+        return True
+
+    def config(self, root: Path) -> list[str]:
+        """
+        Prepare a repository and get the options to pass to git for its next scan.
+
+        Args:
+            root (Path): The root of a git working tree.
+
+        Returns:
+            list[str]: ``-c`` overrides. The first scan of a repository disables
+                fsmonitor to measure the baseline.
+        """
+        if root not in self._config:
+            overrides = None
+            if self._start_daemon(root):
+                overrides = []
+                current = _run_git(
+                    root, "config", "--type=bool", "--get", "core.fsmonitor"
+                )
+                if current.stdout.strip() != "true":
+                    if self.persist:
+                        logger.info("%s: setting core.fsmonitor=true", root)
+                        _run_git(root, "config", "core.fsmonitor", "true")
+                    else:
+                        overrides = ["-c", "core.fsmonitor=true"]
+            self._config[root] = overrides
+        overrides = self._config[root]
+        if overrides is None:
+            return []
+        if "baseline" not in self.timings.get(str(root.resolve()), {}):
+            self._baseline.add(root)
+            return ["-c", "core.fsmonitor=false"]
+        return overrides
+
+    def record(self, root: Path, duration: float) -> None:
+        """
+        Record the duration of a scan and log the time saved against the baseline.
+
+        Args:
+            root (Path): The root of a git working tree.
+            duration (float): The duration of the scan in seconds.
+        """
+        if self._config.get(root) is None:
+            return
+        key = str(root.resolve())
+        if root in self._baseline:
+            self._baseline.discard(root)
+            self.timings[key] = {"baseline": duration}
+            logger.info("%s: unaccelerated scan took %.3fs", root, duration)
+            return
+        timing = self.timings[key]
+        timing["last"] = duration
+        saved = timing["baseline"] - duration
+        logger.info(
+            "%s: took %.3fs, saved %.3fs (%.0f%%) against the unaccelerated scan",
+            root,
+            duration,
+            saved,
+            100 * saved / timing["baseline"] if timing["baseline"] else 0,
         )
-        stdout = result.stdout
-    except subprocess.CalledProcessError as e:
-        logger.info("%s: %s", directory, e.stderr)
-        return []
-    return (line[n:] for line in stdout.split("\0") if line.startswith(ignored_prefix))
+
+    def save(self) -> None:
+        """Write the timings file."""
+        if self.path is None:
+            return
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("w", encoding="utf-8") as file:
+                json.dump(self.timings, file, indent=2, sort_keys=True)
+        except OSError as e:
+            logger.info("Cannot write timings file %s: %s", self.path, e)
 
 
+def git_list_ignored(
+    directory: Path,
+    *,
+    version: Literal[1, 2] = 1,
+    expand_directory: bool = False,
+    backend: Literal["status", "ls-files", "matching", "auto"] = "status",
+    root: Path | None = None,
+    accelerator: Accelerator | None = None,
+    stream: bool = False,
+) -> Iterable[str]:
+    """
+    Get all git-ignored files under the given directory with the given backend.
+
+    Args:
+        directory (Path): The directory to search for git-ignored files.
+        version (Literal[1, 2]): The version of git status porcelain format to use (1 or 2).
+        expand_directory (bool): Whether to list files in git-ignored directories.
+        backend (Literal["status", "ls-files", "matching", "auto"]): `git_status_ignored`,
+            `git_ls_files_ignored`, `git_status_matching_ignored`, or chosen by `choose_backend`.
+        root (Path | None): The root of the git repository containing directory,
+            used by the ``auto`` backend and the accelerator. Default is directory itself.
+        accelerator (Accelerator | None): If given, use the fsmonitor daemon of the repository and time the scan.
+        stream (bool): Read the output of git as it runs instead of all at once, see `_git_records`.
+            The scan is then timed once the result is consumed.
+
+    Returns:
+        Iterable[str]: A generator of paths to git-ignored files, relative to the root of the git repository.
+    """
+    if root is None:
+        root = directory
+    config = [] if accelerator is None else accelerator.config(root)
+    if backend == "auto":
+        backend = choose_backend(root)
+    start = time.perf_counter()
+    if backend == "ls-files":
+        res = git_ls_files_ignored(
+            directory, expand_directory=expand_directory, config=config, stream=stream
+        )
+    elif backend == "matching":
+        res = git_status_matching_ignored(directory, config=config, stream=stream)
+    else:
+        res = git_status_ignored(
+            directory,
+            version=version,
+            expand_directory=expand_directory,
+            config=config,
+            stream=stream,
+        )
+    if accelerator is None:
+        return res
+    if stream:
+        return _timed(res, accelerator, root, start)
+    accelerator.record(root, time.perf_counter() - start)
+    return res
+
+
+def _timed(
+    records: Iterable[str], accelerator: Accelerator, root: Path, start: float
+) -> Iterator[str]:
+    """Yield the records of a streamed scan and record its duration once they are consumed."""
+    yield from records
+    accelerator.record(root, time.perf_counter() - start)
+
+
+@lru_cache(maxsize=None)
 def _find_git_root(directory: Path) -> Path | None:
     """
     Find the root directory of the git repository.
 
+    This is memoized on every directory visited, so looking up many paths
+    in the same tree only walks each directory once.
+
     Args:
         directory (Path): The absolute path to start searching from.
 
     Returns:
         Path | None: The root directory of the git repository, or None if not found.
     """
-    while not (directory / ".git").exists():
-        logger.debug("Recursing from directory: %s", directory)
-        parent = directory.parent
-        # either / or .
-        if parent == directory:
-            return None
-        directory = parent
-    return directory
+    if (directory / ".git").exists():
+        return directory
+    logger.debug("Recursing from directory: %s", directory)
+    parent = directory.parent
+    # either / or .
+    if parent == directory:
+        return None
+    return _find_git_root(parent)
 
 
 def _find_relative_to_git_root(directory: Path) -> Path | None:
@@ -130,6 +619,8 @@ def git_subdir_get_ignored_files(
     *,
     version: Literal[1, 2] = 1,
     expand_directory: bool = False,
+    backend: Literal["status", "ls-files", "matching", "auto"] = "status",
+    accelerator: Accelerator | None = None,
 ) -> Iterable[Path]:
     """
     Get all git-ignored files under the given directory, which is a subdirectory of a git repository.
@@ -138,6 +629,8 @@ def git_subdir_get_ignored_files(
         directory (Path): The directory to search for git-ignored files.
         version (Literal[1, 2]): The version of git status porcelain format to use (1 or 2).
         expand_directory (bool): Whether to list files in git-ignored directories.
+        backend (Literal["status", "ls-files", "matching", "auto"]): The listing backend, see `git_list_ignored`.
+        accelerator (Accelerator | None): If given, accelerate repeat scans, see `Accelerator`.
 
     Returns:
         Iterable[Path]: A generator of paths to git-ignored files.
@@ -146,20 +639,31 @@ def git_subdir_get_ignored_files(
         git_root = _find_git_root(directory)
         if git_root is None:
             return []
-        paths = git_status_ignored(
+        paths = git_list_ignored(
             directory,
             version=version,
             expand_directory=expand_directory,
+            backend=backend,
+            accelerator=accelerator,
+            root=git_root,
         )
         res = (git_root / path for path in paths)
     else:
-        relative_to_git_root = f"{_find_relative_to_git_root(directory)}/"
-        if relative_to_git_root is None:
+        relative = _find_relative_to_git_root(directory)
+        if relative is None:
             return []
-        paths = git_status_ignored(
+        relative_to_git_root = f"{relative}/"
+        paths = git_list_ignored(
             directory,
             version=version,
             expand_directory=expand_directory,
+            backend=backend,
+            accelerator=accelerator,
+            root=(
+                _find_git_root(directory.resolve())
+                if backend == "auto" or accelerator is not None
+                else None
+            ),
         )
         # because git status . is used, path must starts with the relative_to_git_root
         res = (directory / path.removeprefix(relative_to_git_root) for path in paths)
@@ -171,6 +675,8 @@ def git_dir_get_ignored_files(
     *,
     version: Literal[1, 2] = 1,
     expand_directory: bool = False,
+    backend: Literal["status", "ls-files", "matching", "auto"] = "status",
+    accelerator: Accelerator | None = None,
 ) -> Iterable[Path]:
     """
     Get all git-ignored files under the given directory, which is a git repository.
@@ -179,23 +685,151 @@ def git_dir_get_ignored_files(
         directory (Path): The directory to search for git-ignored files.
         version (Literal[1, 2]): The version of git status porcelain format to use (1 or 2).
         expand_directory (bool): Whether to list files in git-ignored directories.
+        backend (Literal["status", "ls-files", "matching", "auto"]): The listing backend, see `git_list_ignored`.
+        accelerator (Accelerator | None): If given, accelerate repeat scans, see `Accelerator`.
 
     Returns:
         Iterable[Path]: A generator of paths to git-ignored files.
     """
-    paths = git_status_ignored(
+    paths = git_list_ignored(
         directory,
         version=version,
         expand_directory=expand_directory,
+        backend=backend,
+        accelerator=accelerator,
     )
     return (directory / path for path in paths)
 
 
+def _resolve_git_dir(dot_git: Path) -> Path | None:
+    """
+    Resolve the real git directory behind a ``.git`` entry.
+
+    Args:
+        dot_git (Path): A ``.git`` directory, or a ``.git`` file containing a ``gitdir:`` pointer
+            as found in linked worktrees and submodules.
+
+    Returns:
+        Path | None: The resolved git directory, or None if the pointer is broken.
+    """
+    if dot_git.is_file():
+        try:
+            with dot_git.open("r", encoding="utf-8") as file:
+                line = file.readline().strip()
+        except OSError:
+            return None
+        if not line.startswith("gitdir:"):
+            return None
+        dot_git = dot_git.parent / line.removeprefix("gitdir:").strip()
+    return dot_git.resolve() if dot_git.is_dir() else None
+
+
+def _submodule_paths(
+    directory: Path,
+    regex=re.compile(r"^\s*path\s*=\s*(.+?)\s*$", re.MULTILINE),
+) -> list[Path]:
+    """
+    List the submodules declared in ``.gitmodules``.
+
+    Args:
+        directory (Path): The root of a git working tree.
+
+    Returns:
+        list[Path]: The submodule working trees.
+    """
+    try:
+        with (directory / ".gitmodules").open("r", encoding="utf-8") as file:
+            text = file.read()
+    except OSError:
+        return []
+    return [directory / path.strip('"') for path in regex.findall(text)]
+
+
+def _worktree_paths(git_dir: Path) -> list[Path]:
+    """
+    List the linked worktrees registered in ``$GIT_DIR/worktrees``.
+
+    Args:
+        git_dir (Path): A resolved git directory.
+
+    Returns:
+        list[Path]: The worktree roots.
+    """
+    res = []
+    try:
+        entries = list(os.scandir(git_dir / "worktrees"))
+    except OSError:
+        return res
+    for entry in entries:
+        try:
+            with open(os.path.join(entry.path, "gitdir"), encoding="utf-8") as file:
+                # path to the .git file of the worktree
+                res.append(Path(file.readline().strip()).parent)
+        except OSError:
+            continue
+    return res
+
+
+def discover_repositories(directory: Path) -> list[Path]:
+    """
+    Find the git working trees under the given directory using git metadata.
+
+    Unlike globbing ``**/.git``, this never walks into ``.git`` directories,
+    follows ``gitdir:`` pointers, deduplicates working trees by their real git directory,
+    and registers submodules from ``.gitmodules`` and linked worktrees from
+    ``$GIT_DIR/worktrees`` without walking their trees.
+    Repositories nested in a submodule but not declared as its submodules are not found.
+
+    Args:
+        directory (Path): The directory to search for git repositories.
+
+    Returns:
+        list[Path]: The roots of the git working trees.
+    """
+    root = directory.resolve()
+    git_dirs: set[Path] = set()
+    resolved: set[Path] = set()
+    res: list[Path] = []
+
+    def register(worktree: Path) -> None:
+        git_dir = _resolve_git_dir(worktree / ".git")
+        if git_dir is None or git_dir in git_dirs:
+            return
+        git_dirs.add(git_dir)
+        res.append(worktree)
+        for child in chain(_submodule_paths(worktree), _worktree_paths(git_dir)):
+            # only worktrees under the scanned directory are listed, expressed
+            # like the paths os.walk yields so that they compare equal
+            real = child.resolve()
+            if real.is_relative_to(root):
+                child = directory / real.relative_to(root)
+                resolved.add(child)
+                register(child)
+
+    for dirpath, dirnames, filenames in os.walk(directory):
+        current = Path(dirpath)
+        # registered from metadata after its parent was listed
+        if current in resolved:
+            dirnames.clear()
+            continue
+        if ".git" in dirnames or ".git" in filenames:
+            register(current)
+        dirnames[:] = [
+            name
+            for name in dirnames
+            if name != ".git" and current / name not in resolved
+        ]
+    return res
+
+
 def get_ignored_files(
     directory: Path,
     *,
     version: Literal[1, 2] = 1,
     expand_directory: bool = False,
+    discover: Literal["glob", "metadata"] = "glob",
+    backend: Literal["status", "ls-files", "matching", "auto"] = "status",
+    accelerator: Accelerator | None = None,
 ) -> Iterable[Path]:
     """
     List all git-ignored files under the given directory.
@@ -207,18 +841,30 @@ def get_ignored_files(
         directory (Path): The directory to search for git-ignored files.
         version (Literal[1, 2]): The version of git status porcelain format to use.
         expand_directory (bool): Whether to list files in git-ignored directories.
+        discover (Literal["glob", "metadata"]): How to find git repositories:
+            by globbing ``**/.git``, or with `discover_repositories`.
+        backend (Literal["status", "ls-files", "matching", "auto"]): The listing backend, see `git_list_ignored`.
+            With ``auto`` it is chosen per repository.
+        accelerator (Accelerator | None): If given, accelerate repeat scans, see `Accelerator`.
 
     Returns:
         Iterable[Path]: A generator of paths to git-ignored files.
     """
     # TODO: py312+: glob(..., case_sensitive=True)
+    repositories = (
+        discover_repositories(directory)
+        if discover == "metadata"
+        else (git_dir.parent for git_dir in directory.glob("**/.git"))
+    )
     res = (
         git_dir_get_ignored_files(
-            git_dir.parent,
+            repository,
             version=version,
             expand_directory=expand_directory,
+            backend=backend,
+            accelerator=accelerator,
         )
-        for git_dir in directory.glob("**/.git")
+        for repository in repositories
     )
     # If directory is not a git repo, it might be a subdirectory of a git repo.
     return (
@@ -229,6 +875,8 @@ def get_ignored_files(
                 directory,
                 version=version,
                 expand_directory=expand_directory,
+                backend=backend,
+                accelerator=accelerator,
             ),
             *res,
         )
@@ -251,50 +899,1122 @@ def format_path(path: Path) -> str:
     return res
 
 
-def print_ignored_files(
+def _escape_pattern(
+    path: str,
+    syntax: Literal["rsync", "tar"],
+    regex=re.compile(r"[\\*?\[]"),
+) -> str:
+    """
+    Escape the wildcards of a literal path for an exclude pattern.
+
+    rsync only treats backslashes as escapes in patterns containing a wildcard,
+    so paths without wildcards are left as is.
+
+    Args:
+        path (str): The literal path.
+        syntax (Literal["rsync", "tar"]): The pattern syntax.
+
+    Returns:
+        str: The escaped path.
+    """
+    if syntax == "rsync" and not any(c in path for c in "*?["):
+        return path
+    return regex.sub(r"\\\g<0>", path)
+
+
+def emit_excludes(
+    paths: Iterable[str],
+    syntax: Literal["rsync", "tar"],
+    transfer_root: Path,
+    file: IO[str] = sys.stdout,
+) -> None:
+    """
+    Write git-ignored paths as anchored exclude patterns, skipping paths under an emitted directory.
+
+    Patterns are written as soon as their path is listed. As each repository is
+    listed in order, a directory emitted after a path under it only makes that
+    path redundant.
+
+    For rsync, the patterns are relative to the transfer root and start with a slash,
+    directories end with a slash; use ``rsync --exclude-from=FILE TRANSFER_ROOT/ DEST``.
+    For tar, the patterns start with ``./``; use
+    ``tar -C TRANSFER_ROOT --anchored --exclude-from=FILE -cf ARCHIVE .``.
+
+    Args:
+        paths (Iterable[str]): Paths formatted by `format_path`, directories end with a slash.
+            These should not be expanded, so that whole directories are excluded.
+        syntax (Literal["rsync", "tar"]): The pattern syntax.
+        transfer_root (Path): The directory the patterns are relative to.
+            Paths outside of it are skipped.
+        file (IO[str]): Where to write the patterns, one per line.
+    """
+    root = os.path.abspath(transfer_root)
+    prefix = "/" if syntax == "rsync" else "./"
+    emitted: set[str] = set()
+    for path in paths:
+        is_dir = path.endswith(os.path.sep)
+        relative = os.path.relpath(os.path.abspath(path), root)
+        if relative == os.curdir or relative.startswith(os.pardir + os.path.sep):
+            continue
+        if "\n" in relative:
+            logger.info("Skipping path with a newline: %r", path)
+            continue
+        parts = relative.split(os.path.sep)
+        if any(os.path.sep.join(parts[:i]) in emitted for i in range(1, len(parts))):
+            continue
+        if is_dir:
+            emitted.add(relative)
+        pattern = prefix + _escape_pattern(relative.replace(os.path.sep, "/"), syntax)
+        if is_dir and syntax == "rsync":
+            pattern += "/"
+        print(pattern, file=file)
+
+
+def _prefix(path: str, depth: int) -> str:
+    """The first depth components of a path relative to a repository, without a trailing slash."""
+    parts = path.rstrip("/").split("/", depth)
+    return "/".join(parts[:depth])
+
+
+def list_ignored_by_repository(
     directory: Path,
     *,
     version: Literal[1, 2] = 1,
     expand_directory: bool = False,
-    debug: bool = False,
-) -> None:
+    discover: Literal["glob", "metadata"] = "glob",
+    backend: Literal["status", "ls-files", "matching", "auto"] = "status",
+    accelerator: Accelerator | None = None,
+    stream: bool = False,
+) -> Iterator[tuple[Path, Iterable[str]]]:
     """
-    Print all git-ignored files under the given directory.
+    List git-ignored files under the given directory, grouped by git repository.
 
     Args:
         directory (Path): The directory to search for git-ignored files.
         version (Literal[1, 2]): The version of git status porcelain format to use.
         expand_directory (bool): Whether to list files in git-ignored directories.
-        debug (bool): Whether to verify path existence and print to stderr if not found.
+        discover (Literal["glob", "metadata"]): How to find git repositories, see `get_ignored_files`.
+        backend (Literal["status", "ls-files", "matching", "auto"]): The listing backend, see `git_list_ignored`.
+        accelerator (Accelerator | None): If given, accelerate repeat scans, see `Accelerator`.
+        stream (bool): Read the output of git as it runs, see `git_list_ignored`.
+
+    Yields:
+        tuple[Path, Iterable[str]]: The root of a git repository and the paths of its
+            git-ignored files relative to it, as listed by git. If directory is a
+            subdirectory of a git repository, the absolute root of that repository comes first.
     """
-    paths: list[str] = sorted(
-        map(
-            format_path,
-            get_ignored_files(
-                directory,
-                version=version,
-                expand_directory=expand_directory,
-            ),
-        )
+    kwargs = dict(
+        version=version,
+        expand_directory=expand_directory,
+        backend=backend,
+        accelerator=accelerator,
+        stream=stream,
     )
-    if debug:
-        for path_str in paths:
-            # double conversion. We don't care about the performance when debugging.
-            path = Path(path_str)
-            # TODO: py312+: if path.exists(follow_symlinks=False):
-            if path.is_symlink() or path.exists():
-                print(path_str)
-            else:
-                print(path_str, file=sys.stderr)
-    else:
-        for path_str in paths:
-            print(path_str)
+    # If directory is not a git repo, it might be a subdirectory of a git repo.
+    if not (directory / ".git").exists():
+        git_root = _find_git_root(directory.resolve())
+        if git_root is not None:
+            yield git_root, git_list_ignored(directory, root=git_root, **kwargs)
+    repositories = (
+        discover_repositories(directory)
+        if discover == "metadata"
+        else (git_dir.parent for git_dir in directory.glob("**/.git"))
+    )
+    for repository in repositories:
+        yield repository, git_list_ignored(repository, **kwargs)
 
 
-def main() -> None:
-    """
-    Parse command-line arguments and execute the main script functionality.
+def summarize_ignored_files(
+    directory: Path,
+    *,
+    depth: int = 1,
+    version: Literal[1, 2] = 1,
+    expand_directory: bool = False,
+    discover: Literal["glob", "metadata"] = "glob",
+    backend: Literal["status", "ls-files", "matching", "auto"] = "status",
+    accelerator: Accelerator | None = None,
+) -> dict[str, Counter[str]]:
+    """
+    Count git-ignored entries per repository and per path prefix.
+
+    The output of git is read in chunks as it runs and each path is counted and dropped,
+    without building, stat'ing or sorting paths, so memory grows with the number of
+    distinct prefixes rather than with the number of paths.
+
+    Args:
+        directory (Path): The directory to search for git-ignored files.
+        depth (int): The number of leading path components of a prefix,
+            0 to count per repository only.
+        version (Literal[1, 2]): The version of git status porcelain format to use.
+        expand_directory (bool): Whether to list files in git-ignored directories.
+        discover (Literal["glob", "metadata"]): How to find git repositories, see `get_ignored_files`.
+        backend (Literal["status", "ls-files", "matching", "auto"]): The listing backend, see `git_list_ignored`.
+        accelerator (Accelerator | None): If given, accelerate repeat scans, see `Accelerator`.
+
+    Returns:
+        dict[str, Counter[str]]: Counts by prefix, relative to the repository root, by repository.
+            Entries at a depth lower than ``depth`` are counted under their own path.
+    """
+    listings = list_ignored_by_repository(
+        directory,
+        version=version,
+        expand_directory=expand_directory,
+        discover=discover,
+        backend=backend,
+        accelerator=accelerator,
+        stream=True,
+    )
+    res: dict[str, Counter[str]] = {}
+    for repository, paths in listings:
+        counter = res.setdefault(str(repository), Counter())
+        for path in paths:
+            counter[_prefix(path, depth)] += 1
+    return res
+
+
+def print_summary(
+    summary: dict[str, Counter[str]],
+    format: Literal["table", "json"] = "table",
+) -> None:
+    """
+    Print the counts of `summarize_ignored_files`.
+
+    Args:
+        summary (dict[str, Counter[str]]): Counts by prefix by repository.
+        format (Literal["table", "json"]): ``table`` prints a row with the total of each
+            repository followed by a row per prefix, ``json`` prints an object of
+            repositories with their total ``entries`` and their ``prefixes``.
+    """
+    if format == "json":
+        json.dump(
+            {
+                repository: {
+                    "entries": sum(counter.values()),
+                    "prefixes": dict(sorted(counter.items())),
+                }
+                for repository, counter in sorted(summary.items())
+            },
+            sys.stdout,
+            indent=2,
+        )
+        print()
+        return
+    rows = [("ENTRIES", "REPOSITORY", "PREFIX")]
+    for repository, counter in sorted(summary.items()):
+        rows.append((str(sum(counter.values())), repository, ""))
+        rows.extend(
+            (str(count), repository, prefix)
+            for prefix, count in sorted(counter.items())
+            if prefix
+        )
+    widths = [max(len(row[i]) for row in rows) for i in range(2)]
+    for count, repository, prefix in rows:
+        print(f"{count:>{widths[0]}}  {repository:<{widths[1]}}  {prefix}".rstrip())
+
+
+_SIZE_UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+
+def parse_size(
+    text: str,
+    regex=re.compile(r"^\s*(\d+(?:\.\d*)?)\s*([KMGT]?)(?:i?B)?\s*$", re.IGNORECASE),
+) -> int:
+    """
+    Parse a size such as ``500M`` or ``1.5GiB``, with binary units.
+
+    Args:
+        text (str): The size.
+
+    Returns:
+        int: The size in bytes.
+
+    Raises:
+        ValueError: If the size cannot be parsed.
+    """
+    match = regex.match(text)
+    if match is None:
+        raise ValueError(f"invalid size: {text!r}")
+    number, unit = match.groups()
+    return int(float(number) * _SIZE_UNITS[unit.upper()])
+
+
+def format_size(size: float) -> str:
+    """
+    Format a size in bytes with a binary unit.
+
+    Args:
+        size (float): The size in bytes.
+
+    Returns:
+        str: The formatted size, e.g. ``1.5G``.
+    """
+    # not f-strings, which Cython --3str cannot return as str
+    for unit in ("", "K", "M", "G"):
+        if size < 1024:
+            return "%.0f" % size if not unit else "%.1f%s" % (size, unit)
+        size /= 1024
+    return "%.1fT" % size
+
+
+class IgnoredEntry(NamedTuple):
+    """A top-level git-ignored entry and its disk usage."""
+
+    repository: Path
+    path: Path
+    size: int
+    # the latest access or modification time of anything under path
+    last_used: float
+
+
+def _last_used(st: os.stat_result) -> float:
+    # listing a directory updates its access time, including the scans here
+    if stat.S_ISDIR(st.st_mode):
+        return st.st_mtime
+    return max(st.st_atime, st.st_mtime)
+
+
+def measure_entry(path: Path) -> tuple[int, float]:
+    """
+    Measure the disk usage and the last use of a path, like ``du``.
+
+    Symlinks are not followed and hard links are counted once.
+
+    Args:
+        path (Path): A file or directory.
+
+    Returns:
+        tuple[int, float]: The disk usage in bytes and the latest access or
+            modification time of the path or anything under it. Only the modification
+            time of directories is used, as listing them updates their access time.
+    """
+    try:
+        st = path.lstat()
+    except OSError:
+        return 0, 0.0
+    # st_blocks is not available on Windows
+    blocks = hasattr(st, "st_blocks")
+    size = st.st_blocks * 512 if blocks else st.st_size
+    last_used = _last_used(st)
+    seen = {(st.st_dev, st.st_ino)}
+    stack = [str(path)] if stat.S_ISDIR(st.st_mode) else []
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                if st.st_nlink > 1:
+                    key = (st.st_dev, st.st_ino)
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                size += st.st_blocks * 512 if blocks else st.st_size
+                last_used = max(last_used, _last_used(st))
+                if stat.S_ISDIR(st.st_mode):
+                    stack.append(entry.path)
+    return size, last_used
+
+
+def plan_eviction(
+    entries: list[IgnoredEntry],
+    budget: int,
+    *,
+    scope: Literal["repository", "forest"] = "repository",
+) -> list[IgnoredEntry]:
+    """
+    Choose the least recently used entries to delete to get under a budget.
+
+    Args:
+        entries (list[IgnoredEntry]): The measured entries.
+        budget (int): The maximum disk usage in bytes to keep.
+        scope (Literal["repository", "forest"]): Whether the budget applies to
+            each repository or to all entries together.
+
+    Returns:
+        list[IgnoredEntry]: The entries to delete, least recently used first.
+    """
+    groups: dict[Path | None, list[IgnoredEntry]] = {}
+    for entry in entries:
+        groups.setdefault(
+            entry.repository if scope == "repository" else None, []
+        ).append(entry)
+    res = []
+    for group in groups.values():
+        total = sum(entry.size for entry in group)
+        for entry in sorted(group, key=lambda entry: entry.last_used):
+            if total <= budget:
+                break
+            res.append(entry)
+            total -= entry.size
+    res.sort(key=lambda entry: entry.last_used)
+    return res
+
+
+def _remove(path: Path) -> None:
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path)
+    else:
+        path.unlink()
+
+
+def evict_ignored_files(
+    directory: Path,
+    budget: int,
+    *,
+    scope: Literal["repository", "forest"] = "repository",
+    dry_run: bool = False,
+    jobs: int | None = None,
+    discover: Literal["glob", "metadata"] = "glob",
+    backend: Literal["status", "ls-files", "matching", "auto"] = "status",
+    accelerator: Accelerator | None = None,
+    patterns: Sequence[str] = (),
+    files: bool = False,
+) -> None:
+    """
+    Delete the least recently used git-ignored entries until under a disk budget.
+
+    The top-level git-ignored entries, i.e. the listing without expanded directories,
+    are measured in parallel with `measure_entry`. Only directories, such as build
+    caches, are evicted unless files is set, so ignored files such as ``.env`` are kept.
+    Entries containing another git repository are never deleted. The budget applies
+    to the evictable entries only. The plan is printed one entry per line
+    followed by a total, whether or not it is carried out.
+
+    Args:
+        directory (Path): The directory to search for git-ignored files.
+        budget (int): The maximum disk usage in bytes of git-ignored files to keep.
+        scope (Literal["repository", "forest"]): Whether the budget applies to
+            each repository or to all of them together.
+        dry_run (bool): Only print the plan.
+        jobs (int | None): The number of threads measuring entries. Default is the number of CPUs plus 4, at most 32.
+        discover (Literal["glob", "metadata"]): How to find git repositories, see `get_ignored_files`.
+        backend (Literal["status", "ls-files", "matching", "auto"]): The listing backend, see `git_list_ignored`.
+        accelerator (Accelerator | None): If given, accelerate repeat scans, see `Accelerator`.
+        patterns (Sequence[str]): If given, only evict entries whose name matches one of
+            these shell patterns, e.g. ``node_modules`` or ``.venv``.
+        files (bool): Also evict git-ignored files and symlinks, not only directories.
+    """
+    candidates: list[tuple[Path, Path]] = []
+    # repositories and their parent directories
+    ancestors: set[Path] = set()
+    for repository, paths in list_ignored_by_repository(
+        directory,
+        discover=discover,
+        backend=backend,
+        accelerator=accelerator,
+    ):
+        resolved = repository.resolve()
+        ancestors.add(resolved)
+        ancestors.update(resolved.parents)
+        candidates.extend(
+            (repository, repository / path)
+            for path in paths
+            # git lists directories with a trailing slash
+            if files or path.endswith("/")
+        )
+    evictable = []
+    for repository, path in candidates:
+        if patterns and not any(fnmatch(path.name, pattern) for pattern in patterns):
+            continue
+        if path.resolve() in ancestors:
+            logger.info("Keeping %s as it contains a git repository", path)
+        else:
+            evictable.append((repository, path))
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        sizes = executor.map(measure_entry, (path for _, path in evictable))
+        entries = [
+            IgnoredEntry(repository, path, *measured)
+            for (repository, path), measured in zip(evictable, sizes)
+        ]
+
+    plan = plan_eviction(entries, budget, scope=scope)
+    width = max((len(format_size(entry.size)) for entry in plan), default=0)
+    for entry in plan:
+        print(
+            f"{'would evict' if dry_run else 'evicting'}"
+            f"  {format_size(entry.size):>{width}}"
+            f"  {time.strftime('%Y-%m-%d %H:%M', time.localtime(entry.last_used))}"
+            f"  {format_path(entry.path)}"
+        )
+        if not dry_run:
+            try:
+                _remove(entry.path)
+            except OSError as e:
+                logger.error("Cannot remove %s: %s", entry.path, e)
+    total = sum(entry.size for entry in entries)
+    freed = sum(entry.size for entry in plan)
+    print(
+        f"{'would evict' if dry_run else 'evicted'} {len(plan)} of {len(entries)} entries,"
+        f" {format_size(freed)} of {format_size(total)}, budget {format_size(budget)} per {scope}"
+    )
+
+
+def print_ignored_files(
+    directory: Path,
+    *,
+    version: Literal[1, 2] = 1,
+    expand_directory: bool = False,
+    debug: bool = False,
+    snapshot: Path | None = None,
+    discover: Literal["glob", "metadata"] = "glob",
+    backend: Literal["status", "ls-files", "matching", "auto"] = "status",
+    accelerator: Accelerator | None = None,
+    excludes: Literal["rsync", "tar"] | None = None,
+    transfer_root: Path | None = None,
+) -> None:
+    """
+    Print all git-ignored files under the given directory.
+
+    Args:
+        directory (Path): The directory to search for git-ignored files.
+        version (Literal[1, 2]): The version of git status porcelain format to use.
+        expand_directory (bool): Whether to list files in git-ignored directories.
+        debug (bool): Whether to verify path existence and print to stderr if not found.
+        snapshot (Path | None): If given, write a binary snapshot index to this file
+            instead of printing, see `write_snapshot`.
+        discover (Literal["glob", "metadata"]): How to find git repositories, see `get_ignored_files`.
+        backend (Literal["status", "ls-files", "matching", "auto"]): The listing backend, see `git_list_ignored`.
+        accelerator (Accelerator | None): If given, accelerate repeat scans, see `Accelerator`.
+        excludes (Literal["rsync", "tar"] | None): If given, write exclude patterns for this tool
+            instead of printing, see `emit_excludes`. Directories are not expanded.
+        transfer_root (Path | None): The directory the exclude patterns are relative to.
+            Default is directory.
+    """
+    ignored = map(
+        format_path,
+        get_ignored_files(
+            directory,
+            version=version,
+            expand_directory=expand_directory and excludes is None,
+            discover=discover,
+            backend=backend,
+            accelerator=accelerator,
+        ),
+    )
+    if excludes is not None:
+        emit_excludes(
+            ignored, excludes, directory if transfer_root is None else transfer_root
+        )
+        return
+    if snapshot is not None:
+        write_snapshot(snapshot, ignored)
+        return
+    paths: list[str] = sorted(ignored)
+    if debug:
+        for path_str in paths:
+            # double conversion. We don't care about the performance when debugging.
+            path = Path(path_str)
+            # TODO: py312+: if path.exists(follow_symlinks=False):
+            if path.is_symlink() or path.exists():
+                print(path_str)
+            else:
+                print(path_str, file=sys.stderr)
+    else:
+        for path_str in paths:
+            print(path_str)
+
+
+# snapshot file layout, all integers little-endian:
+# header: magic, version, number of entries per block
+# then 2 tables, all ignored paths followed by ignored directories only, each as
+# table header: number of entries, number of blocks, size of the entry data
+# block offsets: one per block, relative to the start of the entry data
+# entry data: front-coded entries, each an entry header followed by the suffix.
+# The first entry of each block shares nothing with its predecessor, so blocks
+# can be binary-searched by their first entry without decoding anything else.
+_SNAPSHOT_MAGIC = b"GITIGNSN"
+_SNAPSHOT_VERSION = 1
+_SNAPSHOT_BLOCK_SIZE = 16
+_SNAPSHOT_HEADER = struct.Struct("<8sII")
+_TABLE_HEADER = struct.Struct("<QQQ")
+_BLOCK_OFFSET = struct.Struct("<Q")
+# length of the prefix shared with the previous entry, length of the suffix
+_ENTRY_HEADER = struct.Struct("<HH")
+
+
+def _encode_table(entries: list[bytes], block_size: int) -> bytes:
+    """
+    Front-code sorted entries into a snapshot table.
+
+    Args:
+        entries (list[bytes]): The sorted, deduplicated entries.
+        block_size (int): The number of entries per block.
+
+    Returns:
+        bytes: The encoded table.
+    """
+    offsets = bytearray()
+    data = bytearray()
+    previous = b""
+    for i, entry in enumerate(entries):
+        if i % block_size == 0:
+            offsets += _BLOCK_OFFSET.pack(len(data))
+            shared = 0
+        else:
+            shared = len(os.path.commonprefix((previous, entry)))
+        suffix = entry[shared:]
+        data += _ENTRY_HEADER.pack(shared, len(suffix))
+        data += suffix
+        previous = entry
+    n_blocks = len(offsets) // _BLOCK_OFFSET.size
+    return _TABLE_HEADER.pack(len(entries), n_blocks, len(data)) + offsets + data
+
+
+def write_snapshot(path: Path, ignored: Iterable[str]) -> None:
+    """
+    Write a sorted, prefix-compressed binary index of git-ignored paths.
+
+    Directories are expected to end with a path separator, as formatted by `format_path`.
+    Read it back with `Snapshot`.
+
+    Args:
+        path (Path): The snapshot file to write.
+        ignored (Iterable[str]): The git-ignored paths.
+    """
+    entries = sorted({os.fsencode(entry) for entry in ignored})
+    sep = os.fsencode(os.path.sep)
+    directories = [entry for entry in entries if entry.endswith(sep)]
+    with path.open("wb") as file:
+        file.write(
+            _SNAPSHOT_HEADER.pack(
+                _SNAPSHOT_MAGIC, _SNAPSHOT_VERSION, _SNAPSHOT_BLOCK_SIZE
+            )
+        )
+        file.write(_encode_table(entries, _SNAPSHOT_BLOCK_SIZE))
+        file.write(_encode_table(directories, _SNAPSHOT_BLOCK_SIZE))
+
+
+class _SnapshotTable:
+    """A read-only view of a front-coded table in a snapshot."""
+
+    def __init__(self, buffer: mmap.mmap, offset: int, block_size: int) -> None:
+        """
+        Args:
+            buffer (mmap.mmap): The mapped snapshot file.
+            offset (int): The offset of the table header.
+            block_size (int): The number of entries per block.
+        """
+        self.buffer = buffer
+        self.block_size = block_size
+        self.count, self.n_blocks, size = _TABLE_HEADER.unpack_from(buffer, offset)
+        self._offsets = offset + _TABLE_HEADER.size
+        self._data = self._offsets + self.n_blocks * _BLOCK_OFFSET.size
+        self.end = self._data + size
+
+    def _block_start(self, k: int) -> int:
+        return (
+            self._data
+            + _BLOCK_OFFSET.unpack_from(
+                self.buffer, self._offsets + k * _BLOCK_OFFSET.size
+            )[0]
+        )
+
+    def _head(self, k: int) -> bytes:
+        """Get the first entry of block k."""
+        pos = self._block_start(k) + _ENTRY_HEADER.size
+        _, n = _ENTRY_HEADER.unpack_from(self.buffer, pos - _ENTRY_HEADER.size)
+        return self.buffer[pos : pos + n]
+
+    def _block(self, k: int) -> Iterator[bytes]:
+        """Decode the entries of block k."""
+        buffer = self.buffer
+        pos = self._block_start(k)
+        end = self._block_start(k + 1) if k + 1 < self.n_blocks else self.end
+        entry = b""
+        while pos < end:
+            shared, n = _ENTRY_HEADER.unpack_from(buffer, pos)
+            pos += _ENTRY_HEADER.size
+            entry = entry[:shared] + buffer[pos : pos + n]
+            pos += n
+            yield entry
+
+    def lower_bound(self, key: bytes) -> bytes | None:
+        """
+        Find the first entry not less than key.
+
+        Args:
+            key (bytes): The key to search for.
+
+        Returns:
+            bytes | None: The entry, or None if all entries are less than key.
+        """
+        if not self.n_blocks:
+            return None
+        # find the last block whose first entry is not greater than key
+        lo, hi = 0, self.n_blocks
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._head(mid) <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        k = max(lo - 1, 0)
+        for entry in self._block(k):
+            if entry >= key:
+                return entry
+        return self._head(k + 1) if k + 1 < self.n_blocks else None
+
+    def __contains__(self, key: bytes) -> bool:
+        return self.lower_bound(key) == key
+
+
+class Snapshot:
+    """
+    A memory-mapped snapshot of git-ignored paths written by `write_snapshot`.
+
+    Lookups binary-search the mapped file directly, so opening a snapshot does
+    not read or parse it as a whole. Paths are looked up as they were listed
+    when the snapshot was taken, i.e. absolute if the scanned directory was.
+    """
+
+    def __init__(self, path: Path) -> None:
+        """
+        Open and map a snapshot.
+
+        Args:
+            path (Path): The snapshot file.
+
+        Raises:
+            ValueError: If the file is not a snapshot of a supported version.
+        """
+        with path.open("rb") as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, block_size = _SNAPSHOT_HEADER.unpack_from(self.buffer, 0)
+        if magic != _SNAPSHOT_MAGIC or version != _SNAPSHOT_VERSION:
+            self.buffer.close()
+            raise ValueError(
+                f"{path} is not a gitignored snapshot of version {_SNAPSHOT_VERSION}"
+            )
+        self.paths = _SnapshotTable(self.buffer, _SNAPSHOT_HEADER.size, block_size)
+        self.directories = _SnapshotTable(self.buffer, self.paths.end, block_size)
+        self._sep = os.fsencode(os.path.sep)
+
+    def close(self) -> None:
+        """Unmap the snapshot."""
+        self.buffer.close()
+
+    def __enter__(self) -> Snapshot:
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.paths.count
+
+    def __contains__(self, path: str) -> bool:
+        """Whether the path, or the directory of this name, is listed as git-ignored."""
+        key = os.fsencode(path)
+        return key in self.paths or key + self._sep in self.directories
+
+    def is_ignored(self, path: str) -> bool:
+        """
+        Whether the path is listed as git-ignored or is under a git-ignored directory.
+
+        Args:
+            path (str): The path to look up.
+
+        Returns:
+            bool: Whether the path is git-ignored.
+        """
+        if path in self:
+            return True
+        key = os.fsencode(path)
+        sep = self._sep
+        i = key.find(sep)
+        while i >= 0:
+            if key[: i + 1] in self.directories:
+                return True
+            i = key.find(sep, i + 1)
+        return False
+
+    def has_prefix(self, prefix: str) -> bool:
+        """
+        Whether any git-ignored path starts with the given prefix.
+
+        Args:
+            prefix (str): The prefix, e.g. a directory ending with a path separator.
+
+        Returns:
+            bool: Whether such a path exists.
+        """
+        key = os.fsencode(prefix)
+        entry = self.paths.lower_bound(key)
+        return entry is not None and entry.startswith(key)
+
+
+class IgnoreRule(NamedTuple):
+    """
+    The ignore rule matching a path, as reported by ``git check-ignore --verbose``.
+
+    Attributes:
+        source (str): The file containing the pattern, relative to the repository root
+            unless it is outside of it, e.g. ``core.excludesFile``.
+        linenum (int): The line number of the pattern in the source.
+        pattern (str): The pattern. It starts with ``!`` if it un-ignores the path.
+    """
+
+    source: str
+    linenum: int
+    pattern: str
+
+    @property
+    def ignored(self) -> bool:
+        """Whether the matching rule ignores the path, as opposed to negating it."""
+        return not self.pattern.startswith("!")
+
+
+class CheckIgnoreError(RuntimeError):
+    """The ``git check-ignore`` co-process exited, e.g. because git rejected a path."""
+
+
+class CheckIgnore:
+    """
+    A long-lived ``git check-ignore --stdin`` co-process for one repository.
+
+    Paths are queued with `submit` and written to git in batches by a writer thread,
+    while `answer` reads the answers back in the same order, so many paths are in
+    flight at once and neither side waits for a pipe round trip per path. As the
+    writer never blocks the caller, the pipes cannot deadlock. git's stderr goes to
+    a temporary file, which is reported if the co-process exits.
+    """
+
+    # the number of paths handed to the writer thread at once
+    BATCH_SIZE = 256
+
+    def __init__(self, root: Path) -> None:
+        """
+        Start the co-process.
+
+        Args:
+            root (Path): The root of the git repository.
+        """
+        self.root = root
+        command = [
+            "git",
+            "check-ignore",
+            "--stdin",
+            "-z",
+            "--verbose",
+            "--non-matching",
+        ]
+        logger.debug(
+            "Running command in %s: %s", root, subprocess.list2cmdline(command)
+        )
+        self._stderr = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(
+            command,
+            cwd=root,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=self._stderr,
+            # make sure git flushes after each answer, so that an answer does not
+            # wait in git's buffer for paths that are not submitted yet
+            env={**os.environ, "GIT_FLUSH": "1"},
+        )
+        # fields read but not returned yet, and the incomplete field after them
+        self._fields: deque[bytes] = deque()
+        self._rest = b""
+        # paths submitted but not handed to the writer yet
+        self._batch: list[bytes] = []
+        # NUL-terminated batches of paths to write, None to close stdin
+        self._queue: queue.SimpleQueue[bytes | None] = queue.SimpleQueue()
+        self._writer = threading.Thread(target=self._write, daemon=True)
+        self._writer.start()
+
+    def _write(self) -> None:
+        """Write the queued paths to git, flushing whenever the queue runs empty."""
+        stdin = self.process.stdin
+        assert stdin is not None
+        try:
+            while (batch := self._queue.get()) is not None:
+                stdin.write(batch)
+                if self._queue.empty():
+                    stdin.flush()
+            stdin.close()
+        except BrokenPipeError:
+            # git exited, which answer reports
+            pass
+
+    def _read_field(self) -> bytes:
+        """Read one NUL-terminated field from the co-process."""
+        if not self._fields:
+            stdout = self.process.stdout
+            assert stdout is not None
+            while True:
+                chunk = stdout.read1(65536)
+                if not chunk:
+                    self._raise_exited()
+                *fields, self._rest = (self._rest + chunk).split(b"\0")
+                if fields:
+                    break
+            self._fields.extend(fields)
+        return self._fields.popleft()
+
+    def _raise_exited(self) -> None:
+        self.process.wait()
+        self._stderr.seek(0)
+        message = os.fsdecode(self._stderr.read()).strip()
+        raise CheckIgnoreError(
+            message or f"git check-ignore exited unexpectedly in {self.root}"
+        )
+
+    def submit(self, path: str) -> None:
+        """
+        Queue a path, whose answer `answer` returns in submission order.
+
+        Args:
+            path (str): The path relative to the repository root.
+        """
+        self._batch.append(os.fsencode(path))
+        if len(self._batch) >= self.BATCH_SIZE:
+            self._send()
+
+    def _send(self) -> None:
+        """Hand the submitted paths to the writer thread."""
+        self._batch.append(b"")
+        self._queue.put(b"\0".join(self._batch))
+        self._batch = []
+
+    def answer(self) -> IgnoreRule | None:
+        """
+        Read the answer for the oldest submitted path not answered yet.
+
+        Returns:
+            IgnoreRule | None: The matching rule, or None if no rule matches.
+
+        Raises:
+            CheckIgnoreError: If the co-process exited, with git's error message.
+                It cannot be used any more, and the paths submitted after this one
+                are not answered.
+        """
+        if self._batch:
+            self._send()
+        source, linenum, pattern, _ = (self._read_field() for _ in range(4))
+        if not pattern:
+            return None
+        return IgnoreRule(os.fsdecode(source), int(linenum), os.fsdecode(pattern))
+
+    def close(self) -> None:
+        """Terminate the co-process."""
+        # closing stdout first stops a git blocked on unread answers,
+        # which would otherwise block the writer
+        if self.process.stdout is not None:
+            self.process.stdout.close()
+        self._queue.put(None)
+        self._writer.join()
+        self.process.wait()
+        self._stderr.close()
+
+
+# the number of paths query_ignored submits ahead of the answer it waits for
+QUERY_PIPELINE_DEPTH = 4096
+
+
+def query_ignored(paths: Iterable[str]) -> Iterator[tuple[str, IgnoreRule | None]]:
+    """
+    Find the ignore rule matching each of the given paths.
+
+    Each path is routed to its repository with `_find_git_root` and answered by
+    one `CheckIgnore` co-process per repository. Up to `QUERY_PIPELINE_DEPTH` paths
+    are submitted ahead of the answers, which are yielded in the order of the paths,
+    so git answers paths in batches instead of one pipe round trip at a time.
+    The paths do not need to exist. A path git rejects, e.g. one beyond a symbolic
+    link, is logged as an error and answered with None, and the co-process of its
+    repository is restarted for the paths submitted after it.
+
+    Args:
+        paths (Iterable[str]): The paths to query, absolute or relative to the current directory.
+
+    Returns:
+        Iterator[tuple[str, IgnoreRule | None]]: The paths as given, with their
+            matching rule, or None if no rule matches or the path is not in a git repository.
+    """
+    processes: dict[Path, CheckIgnore] = {}
+    # [path, relative path, co-process or None] in input order
+    pending: deque[list[Any]] = deque()
+
+    def pop() -> tuple[str, IgnoreRule | None]:
+        path, _, process = pending.popleft()
+        if process is None:
+            return path, None
+        try:
+            return path, process.answer()
+        except CheckIgnoreError as e:
+            logger.error("%s: %s", path, e)
+        process.close()
+        restarted = processes[process.root] = CheckIgnore(process.root)
+        for entry in pending:
+            if entry[2] is process:
+                restarted.submit(entry[1])
+                entry[2] = restarted
+        return path, None
+
+    cwd = os.getcwd()
+    # git root and the length of its path with a trailing separator by parent
+    # directory, to route paths without building a Path each
+    roots: dict[str, tuple[Path, int] | None] = {}
+    try:
+        for path in paths:
+            absolute = os.path.normpath(os.path.join(cwd, path))
+            parent = os.path.dirname(absolute)
+            if parent in roots:
+                route = roots[parent]
+            else:
+                git_root = _find_git_root(Path(parent))
+                route = roots[parent] = (
+                    None
+                    if git_root is None
+                    else (git_root, len(os.path.join(str(git_root), "")))
+                )
+            if route is None or absolute == str(route[0]):
+                pending.append([path, None, None])
+            else:
+                git_root, length = route
+                if (process := processes.get(git_root)) is None:
+                    process = processes[git_root] = CheckIgnore(git_root)
+                relative = absolute[length:]
+                process.submit(relative)
+                pending.append([path, relative, process])
+            if len(pending) > QUERY_PIPELINE_DEPTH:
+                yield pop()
+        while pending:
+            yield pop()
+    finally:
+        for process in processes.values():
+            process.close()
+
+
+def _read_records(stream: IO[str], nul: bool) -> Iterator[str]:
+    """
+    Read newline or NUL-delimited records from a stream without reading it all first.
+
+    Args:
+        stream (IO[str]): The stream to read from.
+        nul (bool): Whether records are NUL-delimited instead of newline-delimited.
+
+    Returns:
+        Iterator[str]: The records.
+    """
+    if not nul:
+        yield from (line.rstrip("\n") for line in stream)
+        return
+    rest = ""
+    while chunk := stream.read(65536):
+        *records, rest = (rest + chunk).split("\0")
+        yield from records
+    if rest:
+        yield rest
+
+
+def print_query_ignored(
+    paths: Iterable[str],
+    *,
+    verbose: bool = False,
+    non_matching: bool = False,
+    nul: bool = False,
+    snapshot: Path | None = None,
+) -> None:
+    """
+    Print which of the given paths are git-ignored, like ``git check-ignore``.
+
+    Args:
+        paths (Iterable[str]): The paths to query.
+        verbose (bool): Whether to print the matching rule and its source before each path.
+            In this mode, paths matched by a negated rule are printed too.
+        non_matching (bool): Whether to also print paths no rule matches. Only valid with verbose.
+        nul (bool): Whether to terminate output records with NUL instead of newline.
+        snapshot (Path | None): If given, answer from this `Snapshot` instead of git.
+            Rules are not known in this case, so verbose is not supported.
+    """
+    end = "\0" if nul else "\n"
+    write = sys.stdout.write
+    if snapshot is not None:
+        with Snapshot(snapshot) as index:
+            for path in paths:
+                if index.is_ignored(path):
+                    write(f"{path}{end}")
+        return
+    for path, rule in query_ignored(paths):
+        if verbose:
+            if rule is not None:
+                write(f"{rule.source}:{rule.linenum}:{rule.pattern}\t{path}{end}")
+            elif non_matching:
+                write(f"::\t{path}{end}")
+        elif rule is not None and rule.ignored:
+            write(f"{path}{end}")
+
+
+def main_query(argv: list[str]) -> None:
+    """
+    Parse command-line arguments of the query subcommand and execute it.
+
+    Args:
+        argv (list[str]): The arguments after ``query``.
     """
+    parser = argparse.ArgumentParser(
+        prog="gitignored query",
+        description="Check whether paths are git-ignored, routing each path to its own repository.",
+    )
+    parser.add_argument(
+        "paths",
+        metavar="PATH",
+        nargs="*",
+        help="The paths to check. If none is given, read them from stdin.",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="Print the matching rule and its source file for each path.",
+    )
+    parser.add_argument(
+        "-n",
+        "--non-matching",
+        action="store_true",
+        help="Also print paths which do not match any rule. Only valid with --verbose.",
+    )
+    parser.add_argument(
+        "-z",
+        action="store_true",
+        help="Paths read from stdin and printed are NUL-delimited instead of newline-delimited.",
+    )
+    parser.add_argument(
+        "--snapshot",
+        type=Path,
+        metavar="FILE",
+        help="Answer from a snapshot written by gitignored --snapshot instead of git. Paths must be given in the same form as when the snapshot was taken.",
+    )
+
+    args = parser.parse_args(argv)
+    if args.non_matching and not args.verbose:
+        parser.error("--non-matching is only valid with --verbose")
+    if args.snapshot is not None and args.verbose:
+        parser.error("--verbose is not supported with --snapshot")
+    print_query_ignored(
+        args.paths or _read_records(sys.stdin, args.z),
+        verbose=args.verbose,
+        non_matching=args.non_matching,
+        nul=args.z,
+        snapshot=args.snapshot,
+    )
+
+
+def main() -> None:
+    """
+    Parse command-line arguments and execute the main script functionality.
+
+    ``gitignored query ...`` is dispatched to `main_query`. Use ``./query`` to
+    list the git-ignored files under a directory named ``query``.
+    """
+    if sys.argv[1:2] == ["query"]:
+        main_query(sys.argv[2:])
+        return
     parser = argparse.ArgumentParser(
         description="List all git-ignored files under the given directory."
     )
@@ -325,14 +2045,148 @@ def main() -> None:
         action="store_true",
         help="Verify paths exist, print to stderr if not.",
     )
+    parser.add_argument(
+        "--snapshot",
+        type=Path,
+        metavar="FILE",
+        help="Write a binary, memory-mappable index of the git-ignored paths to FILE instead of printing them. Query it with gitignored query --snapshot FILE.",
+    )
+    parser.add_argument(
+        "--discover",
+        default="glob",
+        choices=["glob", "metadata"],
+        help="How to find git repositories: glob for **/.git, or read .gitmodules, worktrees and gitdir: pointers without walking into .git directories and known submodules. Default is %(default)s.",
+    )
+    parser.add_argument(
+        "--backend",
+        default="status",
+        choices=["status", "ls-files", "matching", "auto"],
+        help="How to list git-ignored files: git status --ignored, git ls-files --others --ignored which does not refresh the index, git status --ignored=matching which lists the paths matching an ignore pattern, or auto to use ls-files for repositories with many tracked files. Default is %(default)s.",
+    )
+    parser.add_argument(
+        "--accelerate",
+        nargs="?",
+        const="override",
+        choices=["override", "persist"],
+        help="Start the fsmonitor daemon of each repository, where git supports it, so that git status does not stat every tracked file on repeat scans, and log the time saved per repository against a first, unaccelerated scan. override passes core.fsmonitor with -c to every git invocation, persist writes it to the repository config. Default when given is %(const)s.",
+    )
+    parser.add_argument(
+        "--emit-excludes",
+        choices=["rsync", "tar"],
+        help="Write the git-ignored paths as a minimal list of anchored exclude patterns for rsync or tar --anchored instead of printing them. Directories are not expanded.",
+    )
+    parser.add_argument(
+        "--transfer-root",
+        type=Path,
+        metavar="DIR",
+        help="The directory the exclude patterns are relative to, i.e. the source of the rsync or tar. Default is the directory to list.",
+    )
+    parser.add_argument(
+        "--summary",
+        nargs="?",
+        const="table",
+        choices=["table", "json"],
+        help="Print the number of git-ignored entries per repository and per path prefix instead of the paths, as a table or as JSON. Default when given is %(const)s.",
+    )
+    parser.add_argument(
+        "--depth",
+        type=int,
+        default=1,
+        metavar="N",
+        help="The number of leading path components of the prefixes counted by --summary, 0 to count per repository only. Default is %(default)s.",
+    )
+    parser.add_argument(
+        "--evict-to",
+        type=parse_size,
+        metavar="SIZE",
+        help="Delete the least recently used top-level git-ignored directories until their disk usage is at most SIZE, e.g. 20G, instead of listing them. Entries containing a git repository are kept.",
+    )
+    parser.add_argument(
+        "--evict-pattern",
+        action="append",
+        default=[],
+        metavar="PATTERN",
+        help="Only evict entries whose name matches this shell pattern, e.g. node_modules or '*.cache'. Can be given multiple times. Default is any git-ignored directory.",
+    )
+    parser.add_argument(
+        "--evict-files",
+        action="store_true",
+        help="Also evict git-ignored files, such as logs, not only directories. Beware this includes local configuration such as .env files.",
+    )
+    parser.add_argument(
+        "--evict-scope",
+        default="repository",
+        choices=["repository", "forest"],
+        help="Whether the --evict-to budget applies to each repository or to all repositories together. Default is %(default)s.",
+    )
+    parser.add_argument(
+        "-n",
+        "--dry-run",
+        action="store_true",
+        help="Print what --evict-to would delete without deleting anything.",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="The number of threads measuring entries for --evict-to. Default is the number of CPUs plus 4, at most 32.",
+    )
 
     args = parser.parse_args()
-    print_ignored_files(
-        args.directory,
-        version=args.version,
-        expand_directory=args.expand_directory,
-        debug=args.debug,
+    if args.depth < 0:
+        parser.error("--depth must be non-negative")
+    if args.emit_excludes is not None and args.expand_directory:
+        parser.error("--emit-excludes cannot be used with --expand-directory")
+    if args.backend == "matching" and args.expand_directory:
+        parser.error("--backend matching cannot expand git-ignored directories")
+    accelerator = (
+        None
+        if args.accelerate is None
+        else Accelerator(
+            default_accelerate_path(), persist=args.accelerate == "persist"
+        )
     )
+    if args.evict_to is not None:
+        evict_ignored_files(
+            args.directory,
+            args.evict_to,
+            scope=args.evict_scope,
+            dry_run=args.dry_run,
+            jobs=args.jobs,
+            discover=args.discover,
+            backend=args.backend,
+            accelerator=accelerator,
+            patterns=args.evict_pattern,
+            files=args.evict_files,
+        )
+    elif args.summary is not None:
+        print_summary(
+            summarize_ignored_files(
+                args.directory,
+                depth=args.depth,
+                version=args.version,
+                expand_directory=args.expand_directory,
+                discover=args.discover,
+                backend=args.backend,
+                accelerator=accelerator,
+            ),
+            args.summary,
+        )
+    else:
+        print_ignored_files(
+            args.directory,
+            version=args.version,
+            expand_directory=args.expand_directory,
+            debug=args.debug,
+            snapshot=args.snapshot,
+            discover=args.discover,
+            backend=args.backend,
+            accelerator=accelerator,
+            excludes=args.emit_excludes,
+            transfer_root=args.transfer_root,
+        )
+    if accelerator is not None:
+        accelerator.save()
 
 
 if __name__ == "__main__":
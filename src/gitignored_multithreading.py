@@ -9,18 +9,25 @@ git repositories and subdirectories of git repositories.
 from __future__ import annotations
 
 import argparse
+import json
 import logging
 import os
+import platform
+import shutil
 import subprocess
 import sys
+import threading
+import time
 from concurrent.futures import ThreadPoolExecutor
-from functools import partial
+from contextlib import nullcontext
 from itertools import chain
 from pathlib import Path
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
-    from typing import Iterable, Literal
+    from typing import Any, Callable, Iterable, Literal, TypeVar
+
+    T = TypeVar("T")
 
 try:
     from coloredlogs import ColoredFormatter as Formatter
@@ -193,47 +200,379 @@ def git_dir_get_ignored_files(
     return (directory / path for path in paths)
 
 
+def default_history_path() -> Path:
+    """
+    Get the default location of the scan history file.
+
+    Returns:
+        Path: ``$XDG_CACHE_HOME/gitignored/history.json``, falling back to ``~/.cache``.
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME")
+    return (
+        (Path(cache_home) if cache_home else Path.home() / ".cache")
+        / "gitignored"
+        / "history.json"
+    )
+
+
+def load_history(path: Path) -> dict[str, dict[str, Any]]:
+    """
+    Load the per-repository scan history.
+
+    Args:
+        path (Path): The history file.
+
+    Returns:
+        dict[str, dict[str, Any]]: A mapping from absolute repository paths to their
+            last recorded ``duration`` (in seconds) and ``entries`` (number of ignored paths).
+            Empty if the file does not exist or cannot be read.
+    """
+    try:
+        with path.open("r", encoding="utf-8") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.info("Ignoring unreadable history file %s: %s", path, e)
+        return {}
+
+
+def save_history(path: Path, history: dict[str, dict[str, Any]]) -> None:
+    """
+    Atomically write the per-repository scan history.
+
+    Args:
+        path (Path): The history file.
+        history (dict[str, dict[str, Any]]): The history, as returned by `load_history`.
+    """
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with tmp.open("w", encoding="utf-8") as file:
+            json.dump(history, file, indent=1, sort_keys=True)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.info("Cannot write history file %s: %s", path, e)
+
+
+def _git_dir(directory: Path) -> Path:
+    """
+    Locate the git directory of a working tree, following ``gitdir:`` files.
+
+    Args:
+        directory (Path): The root of a git working tree.
+
+    Returns:
+        Path: The git directory, which may not exist if the pointer is broken.
+    """
+    dot_git = directory / ".git"
+    if dot_git.is_file():
+        with dot_git.open("r", encoding="utf-8") as file:
+            gitdir = file.readline().strip().removeprefix("gitdir: ")
+        return directory / gitdir
+    return dot_git
+
+
+def _estimate_cost(directory: Path) -> int:
+    """
+    Estimate the cost of scanning a repository that has no recorded history.
+
+    The size of the index grows with the number of tracked files, which is what
+    ``git status`` spends most of its time on, and is a single ``stat`` away.
+
+    Args:
+        directory (Path): The root of a git repository.
+
+    Returns:
+        int: The size of the index in bytes, or 0 if it cannot be found.
+    """
+    try:
+        return (_git_dir(directory) / "index").stat().st_size
+    except OSError:
+        return 0
+
+
+def schedule_longest_first(
+    directories: list[Path],
+    history: dict[str, dict[str, Any]],
+) -> list[Path]:
+    """
+    Order repositories by expected scan duration, longest first.
+
+    This is the longest-processing-time (LPT) rule: dispatching the expensive
+    repositories first keeps a single large repository from starting last and
+    dominating the total runtime.
+    Repositories with a recorded duration use it directly. Unseen repositories
+    use `_estimate_cost`, converted to seconds with the rate observed on the
+    seen ones when there are any.
+
+    Args:
+        directories (list[Path]): The roots of git repositories.
+        history (dict[str, dict[str, Any]]): The history, as returned by `load_history`.
+
+    Returns:
+        list[Path]: The directories, in dispatch order.
+    """
+    estimates = {directory: _estimate_cost(directory) for directory in directories}
+    durations = {
+        directory: history[key]["duration"]
+        for directory in directories
+        if (key := str(directory.absolute())) in history
+    }
+    total_estimate = sum(estimates[directory] for directory in durations)
+    rate = sum(durations.values()) / total_estimate if total_estimate else 1.0
+    return sorted(
+        directories,
+        key=lambda directory: durations.get(directory, estimates[directory] * rate),
+        reverse=True,
+    )
+
+
+def _timed_git_dir_get_ignored_files(
+    directory: Path,
+    *,
+    version: Literal[1, 2] = 1,
+    expand_directory: bool = False,
+) -> tuple[list[Path], float]:
+    """
+    Run `git_dir_get_ignored_files` and measure how long it takes.
+
+    Returns:
+        tuple[list[Path], float]: The paths to git-ignored files and the duration in seconds.
+    """
+    start = time.perf_counter()
+    res = list(
+        git_dir_get_ignored_files(
+            directory,
+            version=version,
+            expand_directory=expand_directory,
+        )
+    )
+    return res, time.perf_counter() - start
+
+
+# ioprio_set(2) is not exposed by the standard library
+_IOPRIO_SET = {
+    "x86_64": 251,
+    "i386": 289,
+    "i686": 289,
+    "aarch64": 30,
+    "arm64": 30,
+    "riscv64": 30,
+    "armv7l": 314,
+    "ppc64le": 273,
+}
+_IOPRIO_WHO_PROCESS = 1
+_IOPRIO_CLASS_IDLE = 3
+_IOPRIO_CLASS_SHIFT = 13
+
+
+def set_background_priority() -> None:
+    """
+    Lower the CPU and I/O priority of this process to the lowest.
+
+    Both are inherited by every git child spawned afterwards.
+    The I/O priority is set to the idle class with ``ioprio_set`` on Linux,
+    falling back to the ``ionice`` command if the syscall is unavailable.
+    """
+    try:
+        os.nice(19)
+    except OSError as e:
+        logger.info("Cannot lower CPU priority: %s", e)
+    if not sys.platform.startswith("linux"):
+        logger.info("Lowering I/O priority is not supported on %s", sys.platform)
+        return
+    nr = _IOPRIO_SET.get(platform.machine())
+    if nr is not None:
+        import ctypes
+
+        libc = ctypes.CDLL(None, use_errno=True)
+        if (
+            libc.syscall(
+                nr,
+                _IOPRIO_WHO_PROCESS,
+                0,
+                _IOPRIO_CLASS_IDLE << _IOPRIO_CLASS_SHIFT,
+            )
+            == 0
+        ):
+            return
+        logger.info("ioprio_set failed: %s", os.strerror(ctypes.get_errno()))
+    if (ionice := shutil.which("ionice")) is not None:
+        command = [ionice, "-c", str(_IOPRIO_CLASS_IDLE), "-p", str(os.getpid())]
+        logger.debug("Running command: %s", subprocess.list2cmdline(command))
+        if subprocess.run(command, capture_output=True).returncode == 0:
+            return
+    logger.info("Cannot lower I/O priority")
+
+
+class PressureGate:
+    """
+    Limit the number of concurrent git processes by the I/O pressure of the system.
+
+    The limit is read from the ``some avg10`` line of ``/proc/pressure/io`` (Linux PSI):
+    all jobs are allowed below ``low`` percent, a single one above ``high`` percent,
+    and proportionally fewer in between. Without PSI, all jobs are allowed.
+    """
+
+    def __init__(
+        self,
+        jobs: int,
+        *,
+        low: float = 5.0,
+        high: float = 40.0,
+        interval: float = 1.0,
+        path: Path = Path("/proc/pressure/io"),
+    ) -> None:
+        """
+        Args:
+            jobs (int): The maximum number of concurrent git processes.
+            low (float): The pressure in percent below which all jobs are allowed.
+            high (float): The pressure in percent above which a single job is allowed.
+            interval (float): The number of seconds between pressure readings.
+            path (Path): The PSI file to read.
+        """
+        self.jobs = jobs
+        self.low = low
+        self.high = high
+        self.interval = interval
+        self.path = path
+        self.active = 0
+        self._condition = threading.Condition()
+        self._limit = jobs
+        self._read_at = -interval
+
+    def _pressure(self) -> float | None:
+        """Read the 10-second average of the share of time some task stalled on I/O."""
+        try:
+            with self.path.open("r", encoding="utf-8") as file:
+                for line in file:
+                    if line.startswith("some "):
+                        return float(line.split()[1].removeprefix("avg10="))
+        except (OSError, ValueError, IndexError):
+            pass
+        return None
+
+    def limit(self) -> int:
+        """
+        Get the current limit on concurrent git processes, re-reading the pressure at most once per interval.
+
+        Returns:
+            int: The limit, between 1 and jobs.
+        """
+        now = time.monotonic()
+        if now - self._read_at >= self.interval:
+            self._read_at = now
+            pressure = self._pressure()
+            if pressure is None or pressure <= self.low:
+                limit = self.jobs
+            elif pressure >= self.high:
+                limit = 1
+            else:
+                limit = round(
+                    self.jobs
+                    - (self.jobs - 1) * (pressure - self.low) / (self.high - self.low)
+                )
+            if limit != self._limit:
+                logger.debug("I/O pressure %s%%: limiting to %d jobs", pressure, limit)
+            self._limit = limit
+        return self._limit
+
+    def __enter__(self) -> PressureGate:
+        with self._condition:
+            while self.active >= self.limit():
+                self._condition.wait(self.interval)
+            self.active += 1
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+
+def _gated(gate: PressureGate | None, func: Callable[..., T], *args, **kwargs) -> T:
+    """Call func, waiting for the gate first if there is one."""
+    with gate if gate is not None else nullcontext():
+        return func(*args, **kwargs)
+
+
 def get_ignored_files(
     directory: Path,
     *,
     version: Literal[1, 2] = 1,
     expand_directory: bool = False,
+    history: dict[str, dict[str, Any]] | None = None,
+    jobs: int | None = None,
+    background: bool = False,
 ) -> Iterable[Path]:
     """
     List all git-ignored files under the given directory.
 
     This function handles both directories containing git repositories
     and subdirectories of git repositories.
+    Repositories are dispatched longest first, see `schedule_longest_first`.
 
     Args:
         directory (Path): The directory to search for git-ignored files.
         version (Literal[1, 2]): The version of git status porcelain format to use.
         expand_directory (bool): Whether to list files in git-ignored directories.
+        history (dict[str, dict[str, Any]] | None): The scan history used for scheduling.
+            If given, it is updated in place with the durations measured in this run.
+        jobs (int | None): The maximum number of concurrent git processes. Default is
+            the `ThreadPoolExecutor` default.
+        background (bool): Whether to run at the lowest CPU and I/O priority, see
+            `set_background_priority`, and lower the concurrency under I/O pressure,
+            see `PressureGate`. The priority of the whole process is lowered for good.
 
     Returns:
         Iterable[Path]: A generator of paths to git-ignored files.
     """
-    with ThreadPoolExecutor() as executor:
-        # TODO: py312+: glob(..., case_sensitive=True)
-        res = executor.map(
-            partial(
-                git_dir_get_ignored_files,
-                version=version,
-                expand_directory=expand_directory,
-            ),
-            (git_dir.parent for git_dir in directory.glob("**/.git")),
-        )
-        if (directory / ".git").exists():
-            return chain(*res)
+    gate = None
+    if background:
+        set_background_priority()
+        gate = PressureGate(jobs or min(32, (os.cpu_count() or 1) + 4))
+    # TODO: py312+: glob(..., case_sensitive=True)
+    directories = [git_dir.parent for git_dir in directory.glob("**/.git")]
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
         # If directory is not a git repo, it might be a subdirectory of a git repo.
-        else:
-            subdir_ignored = executor.submit(
+        subdir_ignored = (
+            None
+            if (directory / ".git").exists()
+            else executor.submit(
+                _gated,
+                gate,
                 git_subdir_get_ignored_files,
                 directory,
                 version=version,
                 expand_directory=expand_directory,
             )
-            return chain(subdir_ignored.result(), *res)
+        )
+        futures = {
+            git_dir: executor.submit(
+                _gated,
+                gate,
+                _timed_git_dir_get_ignored_files,
+                git_dir,
+                version=version,
+                expand_directory=expand_directory,
+            )
+            for git_dir in schedule_longest_first(directories, history or {})
+        }
+        # keep the output in glob order regardless of the dispatch order
+        res = [futures[git_dir].result() for git_dir in directories]
+    if history is not None:
+        for git_dir, (paths, duration) in zip(directories, res):
+            history[str(git_dir.absolute())] = {
+                "duration": duration,
+                "entries": len(paths),
+            }
+    ignored = (paths for paths, _ in res)
+    return (
+        chain(*ignored)
+        if subdir_ignored is None
+        else chain(subdir_ignored.result(), *ignored)
+    )
 
 
 def format_path(path: Path) -> str:
@@ -258,6 +597,9 @@ def print_ignored_files(
     version: Literal[1, 2] = 1,
     expand_directory: bool = False,
     debug: bool = False,
+    history_path: Path | None = None,
+    jobs: int | None = None,
+    background: bool = False,
 ) -> None:
     """
     Print all git-ignored files under the given directory.
@@ -267,7 +609,12 @@ def print_ignored_files(
         version (Literal[1, 2]): The version of git status porcelain format to use.
         expand_directory (bool): Whether to list files in git-ignored directories.
         debug (bool): Whether to verify path existence and print to stderr if not found.
+        history_path (Path | None): The scan history file used for scheduling and
+            updated afterwards. If None, repositories are scheduled by estimate only.
+        jobs (int | None): The maximum number of concurrent git processes.
+        background (bool): Whether to run at low priority and adapt to I/O pressure.
     """
+    history = None if history_path is None else load_history(history_path)
     paths: list[str] = sorted(
         map(
             format_path,
@@ -275,9 +622,14 @@ def print_ignored_files(
                 directory,
                 version=version,
                 expand_directory=expand_directory,
+                history=history,
+                jobs=jobs,
+                background=background,
             ),
         )
     )
+    if history_path is not None and history is not None:
+        save_history(history_path, history)
     if debug:
         for path_str in paths:
             # double conversion. We don't care about the performance when debugging.
@@ -326,6 +678,29 @@ def main() -> None:
         action="store_true",
         help="Verify paths exist, print to stderr if not.",
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="The maximum number of concurrent git processes.",
+    )
+    parser.add_argument(
+        "--history",
+        type=Path,
+        default=default_history_path(),
+        help="The file recording per-repository scan durations, used to start the slowest repositories first. Default is %(default)s.",
+    )
+    parser.add_argument(
+        "--no-history",
+        action="store_true",
+        help="Do not read or write the history file. Repositories are scheduled by the size of their index only.",
+    )
+    parser.add_argument(
+        "--background",
+        action="store_true",
+        help="Run this and every git process at the lowest CPU and I/O priority, and run fewer jobs when /proc/pressure/io rises.",
+    )
 
     args = parser.parse_args()
     print_ignored_files(
@@ -333,6 +708,9 @@ def main() -> None:
         version=args.version,
         expand_directory=args.expand_directory,
         debug=args.debug,
+        history_path=None if args.no_history else args.history,
+        jobs=args.jobs,
+        background=args.background,
     )
 
 
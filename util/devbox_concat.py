@@ -3,46 +3,285 @@
 from __future__ import annotations
 
 import argparse
+import hashlib
 import json
+import os
 import re
+import sys
 from pathlib import Path
+from typing import Any, NamedTuple
 
-# Compile the regular expression for removing comments
+# whitespace and comments between a trailing comma and the closing bracket
+TRAILING = r"(?:\s|//[^\n]*|/\*.*?\*/)*(?=[\]}])"
+# plain JSON, including strings, is matched in bulk and copied as is, so that
+# the replacement callback only runs for comments and trailing commas
+JSONC_TOKEN = re.compile(
+    r"""
+    (?P<plain>[^"/,]*(?:(?:
+        "[^"\\\n]*(?:\\.[^"\\\n]*)*"
+        | /(?![/*])
+        | ,(?!%(trailing)s)
+    )[^"/,]*)*)
+    (?:
+        (?P<comment>//[^\n]*|/\*.*?\*/)
+        | (?P<unterminated>/\*)
+        | (?P<comma>,%(trailing)s)
+        | "|$
+    )
+    """ % {"trailing": TRAILING},
+    re.DOTALL | re.VERBOSE,
+)
+NON_NEWLINE = re.compile(r"[^\n]")
 
 
-def remove_comments(
-    text: str,
-    regex=re.compile(r"^\s*//.*$", re.MULTILINE),
-) -> str:
-    """Remove comments from JSON content."""
-    return regex.sub("", text)
+class JSONCDecodeError(ValueError):
+    """JSONC parse error located by file, line and column."""
 
+    def __init__(self, msg: str, filename: str, text: str, pos: int) -> None:
+        self.filename = filename
+        self.lineno = text.count("\n", 0, pos) + 1
+        self.colno = pos - text.rfind("\n", 0, pos)
+        super().__init__(f"{filename}:{self.lineno}:{self.colno}: {msg}")
 
-def merge_data(data: list) -> dict:
-    result = {}
-    for item in data:
-        for key, value in item.items():
-            if key in result:
-                if isinstance(result[key], list):
-                    result[key] += value
+
+def strip_jsonc(text: str, filename: str = "<string>") -> str:
+    """Turn JSONC into JSON in a single pass.
+
+    Comments are blanked out with spaces, keeping newlines, so that positions in
+    the result are positions in the original text. A comma following a value and
+    followed only by whitespace or comments before a closing bracket is blanked
+    as well. Any other comma is kept for `json.loads` to reject.
+    """
+    # start of each comment by its end, to look back past comments
+    comments: dict[int, int] = {}
+
+    def replace(match: re.Match) -> str:
+        kind = match.lastgroup
+        start = match.end("plain")
+        if kind == "unterminated":
+            raise JSONCDecodeError("Unterminated comment", filename, text, start)
+        if kind == "comment":
+            comments[match.end()] = start
+        elif kind == "comma":
+            pos = start
+            while pos:
+                if text[pos - 1].isspace():
+                    pos -= 1
+                elif pos in comments:
+                    pos = comments[pos]
                 else:
-                    assert result[key] == value
+                    break
+            if not pos or text[pos - 1] in "[{,:":
+                return match.group()
+        else:
+            # an unterminated string or the end of the text
+            return match.group()
+        return match.group("plain") + NON_NEWLINE.sub(" ", match.group(kind))
+
+    return JSONC_TOKEN.sub(replace, text)
+
+
+def loads_jsonc(text: str, filename: str = "<string>"):
+    """Parse JSONC, reporting errors with file, line and column."""
+    try:
+        return json.loads(strip_jsonc(text, filename))
+    except json.JSONDecodeError as e:
+        # positions are preserved by strip_jsonc
+        raise JSONCDecodeError(e.msg, filename, text, e.pos) from None
+
+
+class Conflict(NamedTuple):
+    """Differing values for the same key, as (file, value) pairs in input order."""
+
+    key: str
+    values: list[tuple[str, Any]]
+    # file whose value was kept
+    kept: str
+
+    def __str__(self) -> str:
+        others = ", ".join(path for path, _ in self.values if path != self.kept)
+        return f"{self.key}: kept the value from {self.kept}, differs in {others}"
+
+
+def merge_data(data: list[tuple[str, dict]]) -> tuple[dict, list[Conflict]]:
+    """Merge devbox.json contents given as (file, data) pairs.
+
+    Lists are concatenated, deduplicated and sorted. For other values the first
+    one wins and every differing value is reported as a conflict.
+    """
+    result: dict = {}
+    sources: dict[str, list[tuple[str, Any]]] = {}
+    for path, item in data:
+        for key, value in item.items():
+            if key in result and isinstance(result[key], list):
+                result[key] += value
             else:
-                result[key] = value
+                # copy lists so that the inputs, which may be cached, are not modified
+                result.setdefault(
+                    key, list(value) if isinstance(value, list) else value
+                )
+                sources.setdefault(key, []).append((path, value))
+    conflicts = [
+        Conflict(key, values, values[0][0])
+        for key, values in sorted(sources.items())
+        if any(value != values[0][1] for _, value in values)
+    ]
     result = {
         k: sorted(set(v)) if isinstance(v, list) else v
         for k, v in sorted(result.items())
     }
-    return result
+    return result, conflicts
+
+
+def merge_lock(data: list[tuple[str, dict]]) -> tuple[dict, list[Conflict]]:
+    """Merge devbox.lock contents given as (file, data) pairs.
+
+    Packages are merged by key and written in sorted order. When the same
+    package is locked differently, the entry with the newest ``last_modified``
+    wins (the later file on ties) and the difference is reported as a conflict.
+    """
+    versions: list[tuple[str, Any]] = []
+    sources: dict[str, list[tuple[str, dict]]] = {}
+    for path, item in data:
+        versions.append((path, item.get("lockfile_version")))
+        for key, value in item.get("packages", {}).items():
+            sources.setdefault(key, []).append((path, value))
+    conflicts = []
+    if any(version != versions[0][1] for _, version in versions):
+        conflicts.append(Conflict("lockfile_version", versions, versions[0][0]))
+    packages = {}
+    for key, values in sorted(sources.items()):
+        # max returns the first maximum, so reverse to prefer later files
+        kept, value = max(
+            reversed(values), key=lambda pair: pair[1].get("last_modified", "")
+        )
+        packages[key] = value
+        if any(other != value for _, other in values):
+            conflicts.append(Conflict(f"packages.{key}", values, kept))
+    return {"lockfile_version": versions[0][1], "packages": packages}, conflicts
+
+
+def default_cache_path() -> Path:
+    """``$XDG_CACHE_HOME/devbox_concat/cache.json``, falling back to ``~/.cache``."""
+    cache_home = os.environ.get("XDG_CACHE_HOME")
+    return (
+        (Path(cache_home) if cache_home else Path.home() / ".cache")
+        / "devbox_concat"
+        / "cache.json"
+    )
 
 
-def concat(paths: list[Path]) -> None:
-    data: list = []
-    for path in paths:
-        with path.open("r", encoding="utf-8") as file:
-            data.append(json.loads(remove_comments(file.read())))
-    result = merge_data(data)
-    print(json.dumps(result, indent=2))
+class Cache:
+    """Parsed inputs keyed by content hash and the input hash of each output.
+
+    Parsed inputs that are neither used during a run nor recorded for an output
+    are dropped on save, so the cache only holds the current inputs.
+    """
+
+    def __init__(self, path: Path | None) -> None:
+        self.path = path
+        self.parsed: dict[str, Any] = {}
+        self.outputs: dict[str, dict[str, Any]] = {}
+        self.used: dict[str, Any] = {}
+        if path is None:
+            return
+        try:
+            with path.open("r", encoding="utf-8") as file:
+                cache = json.load(file)
+            self.parsed = cache["parsed"]
+            self.outputs = cache["outputs"]
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            self.parsed, self.outputs = {}, {}
+            print(f"Ignoring unreadable cache {path}: {e}", file=sys.stderr)
+
+    def load(self, path: Path, digest: str, text: str) -> Any:
+        if digest in self.parsed:
+            data = self.parsed[digest]
+        else:
+            data = loads_jsonc(text, str(path))
+        self.used[digest] = data
+        return data
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+        # keep the inputs of other outputs so that alternating runs stay cached
+        keep = set(self.used).union(
+            *(output["digests"] for output in self.outputs.values())
+        )
+        self.parsed = {
+            digest: self.used[digest] if digest in self.used else self.parsed[digest]
+            for digest in keep
+            if digest in self.used or digest in self.parsed
+        }
+        # unique per process, as make -j runs the devbox.json and devbox.lock rules together
+        tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with tmp.open("w", encoding="utf-8") as file:
+                json.dump({"parsed": self.parsed, "outputs": self.outputs}, file)
+            tmp.replace(self.path)
+        except OSError as e:
+            print(f"Cannot write cache {self.path}: {e}", file=sys.stderr)
+
+
+def file_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def concat(
+    paths: list[Path],
+    output: Path | None = None,
+    *,
+    lock: bool = False,
+    cache_path: Path | None = None,
+) -> list[Conflict]:
+    """Merge paths and write the result to output, or stdout if None.
+
+    Writing to output is skipped when neither the inputs nor the output changed
+    since the last run, in which case the conflicts of that run are returned.
+    """
+    cache = Cache(cache_path)
+    texts = [path.read_bytes() for path in paths]
+    digests = [file_digest(text) for text in texts]
+    combined = file_digest(
+        json.dumps([lock, [str(path) for path in paths], digests]).encode()
+    )
+    if output is not None:
+        previous = cache.outputs.get(str(output))
+        try:
+            if (
+                previous is not None
+                and previous["inputs"] == combined
+                and file_digest(output.read_bytes()) == previous["output"]
+            ):
+                return [
+                    Conflict(key, [tuple(pair) for pair in values], kept)
+                    for key, values, kept in previous["conflicts"]
+                ]
+        except FileNotFoundError:
+            pass
+
+    data = [
+        (str(path), cache.load(path, digest, text.decode("utf-8")))
+        for path, digest, text in zip(paths, digests, texts)
+    ]
+    result, conflicts = (merge_lock if lock else merge_data)(data)
+    text = json.dumps(result, indent=2) + "\n"
+    if output is None:
+        sys.stdout.write(text)
+    else:
+        output.write_text(text, encoding="utf-8")
+        cache.outputs[str(output)] = {
+            "inputs": combined,
+            "digests": digests,
+            "output": file_digest(text.encode("utf-8")),
+            "conflicts": conflicts,
+        }
+    cache.save()
+    return conflicts
 
 
 def main() -> None:
@@ -50,9 +289,46 @@ def main() -> None:
     parser.add_argument(
         "files", metavar="FILE", type=Path, nargs="+", help="JSON files to merge"
     )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        help="write to this file instead of stdout, skipped if already up to date",
+    )
+    parser.add_argument(
+        "--lock", action="store_true", help="merge devbox.lock files by package"
+    )
+    parser.add_argument(
+        "--report", type=Path, help="write the conflicts to this file as JSON"
+    )
+    parser.add_argument(
+        "--strict", action="store_true", help="exit with an error on any conflict"
+    )
+    parser.add_argument(
+        "--cache",
+        type=Path,
+        default=default_cache_path(),
+        help="parse cache (default: %(default)s)",
+    )
+    parser.add_argument("--no-cache", action="store_true", help="disable the cache")
 
     args = parser.parse_args()
-    concat(args.files)
+    try:
+        conflicts = concat(
+            args.files,
+            args.output,
+            lock=args.lock,
+            cache_path=None if args.no_cache else args.cache,
+        )
+    except JSONCDecodeError as e:
+        parser.exit(1, f"{parser.prog}: error: {e}\n")
+    for conflict in conflicts:
+        print(f"{parser.prog}: conflict: {conflict}", file=sys.stderr)
+    if args.report is not None:
+        with args.report.open("w", encoding="utf-8") as file:
+            json.dump([conflict._asdict() for conflict in conflicts], file, indent=2)
+    if args.strict and conflicts:
+        parser.exit(1, f"{parser.prog}: error: {len(conflicts)} conflict(s)\n")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import shutil
+from pathlib import Path
+from typing import NamedTuple
+
+
+class Workload(NamedTuple):
+    dirs: int
+    entries: int
+    symlinks: float = 0.3
+    shared: float = 0.5
+    dangling: float = 0.02
+    non_executable: float = 0.05
+
+
+# named workload sizes, entries are per PATH
+WORKLOADS: dict[str, Workload] = {
+    "small": Workload(dirs=4, entries=200),
+    "medium": Workload(dirs=8, entries=2_000),
+    "large": Workload(dirs=32, entries=20_000),
+}
+
+
+def split_names(workload: Workload) -> tuple[list[str], list[str]]:
+    """Return the command names of PATH1 and PATH2.
+
+    The first ``shared`` fraction of PATH2 overlaps with the tail of PATH1.
+    """
+    n = workload.entries
+    offset = n - round(n * workload.shared)
+    names = [f"cmd{i:06d}" for i in range(offset + n)]
+    return names[:n], names[offset:]
+
+
+def populate(
+    root: Path,
+    names: list[str],
+    workload: Workload,
+    rng: random.Random,
+) -> list[Path]:
+    """Create the PATH directories under root and return them in PATH order.
+
+    Regular files are written to a shared store and symlinked from the PATH
+    directories, similar to a nix profile. Dangling links point into the store
+    at files that do not exist.
+    """
+    store = root.parent / "store"
+    store.mkdir(exist_ok=True)
+    dirs = [root / f"bin{i:02d}" for i in range(workload.dirs)]
+    for directory in dirs:
+        directory.mkdir(parents=True)
+    for name in names:
+        # some commands are duplicated across directories to exercise shadowing
+        for directory in rng.sample(dirs, 2 if rng.random() < 0.1 else 1):
+            path = directory / name
+            roll = rng.random()
+            if roll < workload.dangling:
+                path.symlink_to(os.path.relpath(store / f"missing-{name}", directory))
+            elif roll < workload.dangling + workload.symlinks:
+                target = store / name
+                if not target.exists():
+                    target.write_text("#!/bin/sh\n")
+                    target.chmod(0o755)
+                path.symlink_to(os.path.relpath(target, directory))
+            else:
+                path.write_text("#!/bin/sh\n")
+                if rng.random() >= workload.non_executable:
+                    path.chmod(0o755)
+    return dirs
+
+
+def generate(out: Path, workload: Workload, seed: int = 0) -> None:
+    """Generate a fixture under out, replacing any previous one.
+
+    The PATH strings are written to ``PATH1`` and ``PATH2`` as absolute paths.
+    """
+    if out.exists():
+        shutil.rmtree(out)
+    out.mkdir(parents=True)
+    out = out.resolve()
+    rng = random.Random(seed)
+    for i, names in enumerate(split_names(workload), 1):
+        dirs = populate(out / str(i), names, workload, rng)
+        (out / f"PATH{i}").write_text(os.pathsep.join(map(str, dirs)) + "\n")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Generate deterministic PATH fixtures for diffpath"
+    )
+    parser.add_argument("out", type=Path, help="output directory")
+    parser.add_argument(
+        "-s",
+        "--size",
+        choices=WORKLOADS,
+        default="medium",
+        help="named workload size",
+    )
+    parser.add_argument("--dirs", type=int, help="number of directories per PATH")
+    parser.add_argument("--entries", type=int, help="number of commands per PATH")
+    parser.add_argument(
+        "--symlinks", type=float, help="fraction of entries that are symlinks"
+    )
+    parser.add_argument(
+        "--shared", type=float, help="fraction of commands shared by both PATHs"
+    )
+    parser.add_argument(
+        "--dangling", type=float, help="fraction of entries that are dangling links"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+
+    args = parser.parse_args()
+    overrides = {
+        field: value
+        for field in Workload._fields
+        if (value := getattr(args, field, None)) is not None
+    }
+    generate(args.out, WORKLOADS[args.size]._replace(**overrides), seed=args.seed)
+
+
+if __name__ == "__main__":
+    main()